@@ -1,8 +1,21 @@
 import sys
 import threading
 import time
-import random
 import socket
+import asyncio
+import argparse
+import tempfile
+
+from scheduler import TimerScheduler, AsyncioScheduler
+from outbox import Outbox
+from reliable import ReliableSender
+import metrics
+import protocol
+import snapshot
+from room import Room
+from cluster import launch
+from ratelimit import RateLimiter
+import eventlog
 
 HOST = '0.0.0.0'
 PORT = 5005
@@ -12,423 +25,562 @@ REQUIRED_PLAYERS = 3  # Number of players required to start the game
 GRID_ROWS = 10
 GRID_COLS = 10
 
-board = [[None for _ in range(GRID_COLS)] for _ in range(GRID_ROWS)]
-board_lock = threading.Lock()
+SHARD_SIZE = 0          # > 0 splits each room's board into tiles with their own locks
+LOCKING = True          # False when everything runs on one event loop
+WORKERS = 1             # Receive threads per process
+
+# Owns every selection completion and adjacent-block expiry, for all rooms
+scheduler = TimerScheduler()
+
+# Broadcast coalescing window in seconds; 0 sends every message immediately
+OUTBOX_TICK = 0.01
+STATS_INTERVAL = 10.0
+
+# Seconds an ended room stays up so clients can still fetch the board and scores
+ROOM_LINGER = 10.0
+
+rooms = {}              # room id -> Room
+room_of = {}            # client address -> Room it registered in
+lobby = None            # Room new players are added to until its game starts
+next_room_id = 1
+rooms_lock = threading.Lock()
+
+# Set in each worker process when running with --processes
+cluster = None
 
-clients = {}
-next_id = 1
-colors = ["red", "blue", "green", "purple", "orange", "magenta", "cyan", "brown", "yellow", "pink"]
-game_started = False  # Track if the game has started
-game_ended = False    # Track if the game has ended
+# Clients not heard from for this long are dropped as if they had
+# disconnected; the client sends a heartbeat every couple of seconds.
+# 0 disables eviction.
+CLIENT_TIMEOUT = 15.0
+EVICT_INTERVAL = 2.0
+evicted_clients = 0
 
-selecting_cells = {}
-client_selecting = {}
+# Directory of the event log that lets a restarted server pick its games up
+# again; None keeps games in memory only
+LOG_DIR = None
+CHECKPOINT_INTERVAL = 60.0
+event_log = None
 
-adjacent_blocked_cells = {}
-temp_blocked_during_selection = {}
+# Per-address token buckets: every datagram, and the much costlier register
+MESSAGE_RATE = 200.0    # Datagrams per second; 0 disables the limit
+MESSAGE_BURST = 400
+REGISTER_RATE = 1.0     # Registers per second; 0 disables the limit
+REGISTER_BURST = 5
+message_limiter = RateLimiter(MESSAGE_RATE, MESSAGE_BURST)
+register_limiter = RateLimiter(REGISTER_RATE, REGISTER_BURST)
 
-def is_adjacent(row, col, other_row, other_col):
-    """Check if two cells are adjacent (not diagonally)"""
-    return (row == other_row and abs(col - other_col) == 1) or (col == other_col and abs(row - other_row) == 1)
+MAX_PLAYERS = 10        # Players per game
+MAX_CLIENTS = 10000     # Players across all games in this process
 
-def get_adjacent_cells(row, col):
-    """Get adjacent cells (top, right, bottom, left - not diagonal)"""
-    adjacent = []
-    directions = [(0, 1), (1, 0), (0, -1), (-1, 0)]
+# Local HTTP port serving /metrics; 0 disables it. Worker N of --processes
+# uses METRICS_PORT + N.
+METRICS_PORT = 0
+
+messages_received = metrics.Counter("checkbox_messages_received_total", "Messages received from clients", "type")
+errors = metrics.Counter("checkbox_errors_total", "Exceptions while handling a datagram", "error")
+rejections = metrics.Counter("checkbox_rejected_total", "Datagrams and registrations turned away", "reason")
+
+metrics.Gauge("checkbox_clients", "Registered clients", lambda: len(room_of))
+metrics.Gauge("checkbox_evicted_clients_total", "Clients dropped for not sending heartbeats",
+              lambda: evicted_clients, kind="counter")
+metrics.Gauge("checkbox_rooms", "Open rooms", lambda: len(rooms))
+metrics.Gauge("checkbox_rate_limited_addresses", "Addresses with a partly used token bucket",
+              lambda: len(message_limiter))
+metrics.Gauge("checkbox_selections_in_flight", "Selections waiting to complete",
+              lambda: sum(len(room.engine.selecting_cells) for room in list(rooms.values())))
+metrics.Gauge("checkbox_timer_queue_depth", "Timers queued in the scheduler", lambda: scheduler.pending())
+metrics.Gauge("checkbox_game_deadlines", "Deadlines queued in the game engines",
+              lambda: sum(room.engine.pending_deadlines() for room in list(rooms.values())))
+
+def new_room(sock, room_id):
+    room = rooms[room_id] = Room(room_id, sock, scheduler, GRID_ROWS, GRID_COLS, REQUIRED_PLAYERS,
+                                 shard_size=SHARD_SIZE, locking=LOCKING, max_players=MAX_PLAYERS)
+    room.on_end = room_ended
+    if event_log is not None:
+        event_log.open_room(room_id, GRID_ROWS, GRID_COLS, REQUIRED_PLAYERS)
+        room.log = event_log
+    return room
+
+def open_lobby(sock, room_id=None):
+    """Return the room that is filling up, opening a new one if needed.
     
-    for dr, dc in directions:
-        new_row, new_col = row + dr, col + dc
-        if 0 <= new_row < GRID_ROWS and 0 <= new_col < GRID_COLS:
-            adjacent.append((new_row, new_col))
-            
-    return adjacent
+    With several worker processes the coordinator picks the room instead.
+    """
+    global lobby, next_room_id
+    
+    if room_id is not None:
+        return rooms.get(room_id) or new_room(sock, room_id)
+    
+    if lobby is None or lobby.game_started or len(lobby.clients) >= MAX_PLAYERS:
+        lobby = new_room(sock, next_room_id)
+        next_room_id += 1
+    return lobby
+
+def room_ended(room):
+    if cluster is not None:
+        cluster.room_done(room.room_id)
+    scheduler.call_later(ROOM_LINGER, close_room, room)
 
-def clear_temp_blocks_for_selection(sock, row, col):
-    """Clear temporary blocks associated with a selection"""
-    global temp_blocked_during_selection
+def close_room(room):
+    """Tear a room down and forget its players"""
+    global lobby
     
-    cells_to_unblock = []       
-    for blocked_cell, info in temp_blocked_during_selection.items():
-        if info["selection_cell"] == (row, col):
-            cells_to_unblock.append(blocked_cell)
+    with rooms_lock:
+        if rooms.pop(room.room_id, None) is None:
+            return
+        for addr in list(room.clients):
+            if room_of.get(addr) is room:
+                del room_of[addr]
+        if lobby is room:
+            lobby = None
+        if event_log is not None:
+            event_log.close_room(room.room_id)
     
-    for blocked_cell in cells_to_unblock:
-        if blocked_cell in temp_blocked_during_selection:
-            del temp_blocked_during_selection[blocked_cell]
-            
-            r, c = blocked_cell
-            unblock_msg = f"unblock_adjacent,{r},{c}"
-            for client_addr in clients:
-                sock.sendto(unblock_msg.encode(), client_addr)
-
-def is_board_full():
-    """Check if the game board is full"""
-    for row in board:
-        for cell in row:
-            if cell is None:
-                return False
+    if cluster is not None:
+        cluster.room_done(room.room_id)
+    for addr in list(room.clients):
+        room.sock.forget(addr)
+    room.close()
+    print(f"Room {room.room_id} closed, {len(rooms)} rooms open")
+
+def admit(data, addr):
+    """Check a datagram against its sender's rate limits before doing any work for it"""
+    if MESSAGE_RATE > 0 and not message_limiter.allow(addr):
+        rejections.inc("rate_limited")
+        return False
+    if REGISTER_RATE > 0 and protocol.message_name(data) == 'register' and not register_limiter.allow(addr):
+        rejections.inc("register_rate_limited")
+        return False
+    return True
+
+def admit_next(msg, addr):
+    """Charge a further message packed into an admitted datagram to the same rate limits"""
+    if MESSAGE_RATE > 0 and not message_limiter.allow(addr):
+        rejections.inc("rate_limited")
+        return False
+    if REGISTER_RATE > 0 and msg[0] == 'register' and not register_limiter.allow(addr):
+        rejections.inc("register_rate_limited")
+        return False
     return True
 
-def calculate_scores():
-    """Calculate scores for all players"""
-    scores = {}
+def prune_limiters():
+    """Periodically forget addresses that have not been limited for a while"""
+    message_limiter.prune()
+    register_limiter.prune()
+    scheduler.call_later(EVICT_INTERVAL, prune_limiters)
+
+def handle_datagram(sock, data, addr):
+    """Handle a datagram from the UDP socket, or forward it to the worker that owns its room"""
+    if not admit(data, addr):
+        return
     
-    for row in board:
-        for cell in row:
-            if cell is not None:
-                if cell not in scores:
-                    scores[cell] = 1
-                else:
-                    scores[cell] += 1
+    if cluster is None:
+        handle_message(sock, data, addr)
+        return
     
-    return scores
+    worker, room_id = cluster.route(data, addr)
+    if worker == cluster.index:
+        handle_message(sock, data, addr, room_id)
+    else:
+        cluster.forward(worker, addr, room_id, data)
 
-def get_winners(scores):
-    """Get the player(s) with the highest score"""
-    if not scores:
-        return []
-        
-    max_score = max(scores.values())
-    winners = [player for player, score in scores.items() if score == max_score]
-    return winners
+def handle_message(sock, data, addr, room_id=None):
+    """Decode one datagram from addr and apply it to the game state"""
+    if protocol.is_binary(data):
+        # admit() has charged the first message; a datagram packed with more
+        # pays for each of them and loses the rest once over the limit
+        for index, msg in enumerate(protocol.decode_all(data)):
+            if index > 0 and not admit_next(msg, addr):
+                return
+            handle_command(sock, msg, addr, room_id)
+    else:
+        handle_command(sock, data.decode().split(','), addr, room_id)
 
-def end_game(sock, ended_by=None):
-    """End the game and announce the results"""
-    global game_ended
+def handle_command(sock, msg, addr, room_id=None):
+    """Route one decoded message from addr to its room"""
+    messages_received.inc(msg[0] if msg[0] in protocol.MESSAGES else "unknown")
     
-    if game_ended:
-        return
+    if msg[0] == 'register':
+        # Clients offer the binary protocol with "register,bin1" or a binary
+        # register, and sequenced delivery with "rel1"
+        binary = len(msg) > 1 and msg[1] in (protocol.BINARY_TAG, protocol.BINARY_VERSION)
+        reliable = protocol.RELIABLE_TAG in msg[1:]
+        
+        # Registering again during a game (e.g. because the replies were
+        # lost) gets the same player back rather than a new one
+        with rooms_lock:
+            previous = room_of.get(addr)
+        if previous is not None and not previous.game_ended:
+            previous.rejoin(addr, binary, reliable)
+            return
+        
+        # Once its game is over, registering again moves the client to the lobby
+        with rooms_lock:
+            previous = room_of.pop(addr, None)
+        if previous is not None:
+            leave_room(previous, addr)
+        elif len(room_of) >= MAX_CLIENTS:
+            rejections.inc("server_full")
+            sock.sendto(protocol.encode("rejected", ("server_full",)), addr)
+            return
         
-    game_ended = True
+        sock.forget(addr)
+        
+        with rooms_lock:
+            room = room_of[addr] = open_lobby(sock, room_id)
+        if room.register(addr, binary, reliable) is None:
+            rejections.inc("room_full")
+            with rooms_lock:
+                if room_of.get(addr) is room:
+                    del room_of[addr]
+        return
+    
+    room = room_of.get(addr)
+    if room is None:
+        return
     
-    # Calculate final scores
-    scores = calculate_scores()
-    winners = get_winners(scores)
+    # Any message counts as a sign of life
+    room.players.touch(addr, time.time())
     
-    # Format scores for message
-    score_strings = []
-    for player, score in scores.items():
-        score_strings.append(f"{player},{score}")
+    if msg[0] == 'heartbeat':
+        pass
     
-    winner_string = ",".join(winners)
-    scores_string = ";".join(score_strings)
+    elif msg[0] == 'ack':
+        # Cumulative ack plus any sequence numbers received past a gap
+        sock.ack(addr, int(msg[1]), [int(seq) for seq in str(msg[2]).split(';') if seq])
     
-    # Construct end game message
-    if ended_by:
-        end_message = f"game_end,ended_by,{ended_by},{winner_string},{scores_string}"
-    else:
-        end_message = f"game_end,board_full,{winner_string},{scores_string}"
+    elif msg[0] == 'nack':
+        # Client detected a gap and wants just that range again
+        sock.nack(addr, int(msg[1]), int(msg[2]))
+    
+    elif msg[0] == 'click':
+        room.click(addr, int(msg[1]), int(msg[2]))
     
-    # Send to all clients
-    for client_addr in clients:
-        sock.sendto(end_message.encode(), client_addr)
+    elif msg[0] == 'board_resend':
+        # Client is missing some chunks of a snapshot
+        kind, version, base = int(msg[1]), int(msg[2]), int(msg[3])
+        key = (version, base if kind == snapshot.DELTA else None)
+        seqs = [int(seq) for seq in msg[4].split(';') if seq]
+        room.resend_chunks(addr, key, seqs)
+    
+    elif msg[0] == 'sync':
+        # Client knows the board up to a version and wants what changed since
+        room.send_snapshot(addr, since=int(msg[1]))
+    
+    elif msg[0] == 'get_scores':
+        # Live leaderboard query
+        room.send_scores(addr)
+    
+    elif msg[0] == 'end_game':
+        # Client requested to end the game early
+        room.request_end(addr)
+    
+    elif msg[0] == 'disconnect':
+        drop_client(sock, room, addr)
+
+def drop_client(sock, room, addr):
+    """Forget a client that disconnected or went quiet"""
+    with rooms_lock:
+        if room_of.get(addr) is room:
+            del room_of[addr]
+    leave_room(room, addr)
+    sock.forget(addr)
 
-def selection_complete(sock, row, col, client_addr):
-    """Called when selection timer completes"""
-    global game_ended
+def evict_idle_clients(sock):
+    """Periodically drop clients that stopped sending heartbeats"""
+    global evicted_clients
     
-    with board_lock:
-        if game_ended:
-            return
-            
-        if (row, col) in selecting_cells and selecting_cells[(row, col)]["addr"] == client_addr:
-            client_id = clients[client_addr]["name"]
-            color = clients[client_addr]["color"]
-            board[row][col] = client_id         # Marking the cell occupied by the client
-            
-            del selecting_cells[(row, col)]
-            
-            if client_addr in client_selecting:
-                del client_selecting[client_addr]
-            
-            update_msg = f"update,{row},{col},{client_id},{color}"
-            for c in clients:
-                sock.sendto(update_msg.encode(), c)     #Updating the board for each client
-            
-            clear_temp_blocks_for_selection(sock, row, col)
-            
-            adjacent_cells = get_adjacent_cells(row, col)
-            block_duration = 3.0
-            end_time = time.time() + block_duration
-            
-            for adj_r, adj_c in adjacent_cells:
-                if board[adj_r][adj_c] is None:
-                    adjacent_blocked_cells[(adj_r, adj_c)] = {
-                        "owner": client_id,
-                        "color": color,
-                        "end_time": end_time
-                    }
-                    
-                    block_msg = f"block_adjacent,{adj_r},{adj_c},{client_id},{color},{block_duration}"
-                    for c in clients:
-                        sock.sendto(block_msg.encode(), c)
-            
-            # Check if board is full after this selection
-            if is_board_full():
-                end_game(sock)
-
-def handle_adjacent_cells_timeout():
-    """Check for timed out adjacent blocked cells"""
-    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as notify_sock:
-        while True:
-            time.sleep(0.1)
-            current_time = time.time()
-            
-            with board_lock:
-                cells_to_remove = []
-                
-                for cell, info in adjacent_blocked_cells.items():
-                    if current_time >= info["end_time"]:
-                        cells_to_remove.append(cell)
-                
-                for cell in cells_to_remove:
-                    if cell in adjacent_blocked_cells:
-                        r, c = cell
-                        unblock_msg = f"unblock_adjacent,{r},{c}"
-                        for client_addr in clients:
-                            notify_sock.sendto(unblock_msg.encode(), client_addr)
-                        
-                        del adjacent_blocked_cells[cell]
-
-def handle_selection_timeout():
-    """Check for timed out selections"""
-    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as notify_sock:
-        while True:
-            time.sleep(0.1)
-            current_time = time.time()
-            
-            with board_lock:
-                cells_to_remove = []
-                
-                for (row, col), info in selecting_cells.items():
-                    if current_time >= info["end_time"]:
-                        cells_to_remove.append((row, col))
-                        client_addr = info["addr"]
-                        
-                        if client_addr in client_selecting:
-                            del client_selecting[client_addr]
-                
-                for cell in cells_to_remove:
-                    if cell in selecting_cells:
-                        r, c = cell
-                        cancel_msg = f"selection_cancelled,{r},{c}"
-                        for client_addr in clients:
-                            notify_sock.sendto(cancel_msg.encode(), client_addr)
-                        
-                        clear_temp_blocks_for_selection(notify_sock, r, c)
-                        
-                        del selecting_cells[cell]
-
-def handle_updates():
+    cutoff = time.time() - CLIENT_TIMEOUT
+    with rooms_lock:
+        open_rooms = list(rooms.values())
+    
+    for room in open_rooms:
+        for addr in room.players.idle(cutoff):
+            print(f"Evicting idle client {addr} from room {room.room_id}")
+            drop_client(sock, room, addr)
+            evicted_clients += 1
+    
+    if cluster is not None:
+        cluster.expire(cutoff)
+    
+    scheduler.call_later(EVICT_INTERVAL, evict_idle_clients, sock)
+
+def give_up_on_client(sock, addr):
+    """Drop a client that stopped acking sequenced messages; it can never catch up"""
+    global evicted_clients
+    
+    with rooms_lock:
+        room = room_of.get(addr)
+    if room is not None:
+        print(f"Evicting unresponsive client {addr} from room {room.room_id}")
+        drop_client(sock, room, addr)
+        evicted_clients += 1
+
+def client_counts():
+    """(live, evicted) client counts"""
+    return len(room_of), evicted_clients
+
+def leave_room(room, addr):
+    """Remove a client from a room, closing the room once nobody is left in it"""
+    room.disconnect(addr)
+    if cluster is not None and not room.game_started:
+        cluster.left_lobby(room.room_id)
+    
+    # An empty lobby stays open for the next player
+    with rooms_lock:
+        empty = not room.clients and room is not lobby
+    if empty:
+        close_room(room)
+
+def recover_rooms(sock):
+    """Rebuild the games of a previous run from the event log and start logging again"""
+    global event_log, lobby, next_room_id
+    
+    event_log = eventlog.EventLog(LOG_DIR)
+    metrics.Gauge("checkbox_log_records_total", "Event log records written",
+                  lambda: event_log.records, kind="counter")
+    metrics.Gauge("checkbox_log_commits_total", "Event log group commits (fsyncs)",
+                  lambda: event_log.commits, kind="counter")
+    
+    restored = {}
+    def make_engine(room_id, rows, cols, required_players):
+        room = restored[room_id] = Room(room_id, sock, scheduler, rows, cols, required_players,
+                                        shard_size=SHARD_SIZE, locking=LOCKING, max_players=MAX_PLAYERS)
+        return room.engine
+    engines = eventlog.replay(LOG_DIR, make_engine=make_engine)
+    
+    with rooms_lock:
+        for room_id, engine in sorted(engines.items()):
+            room = restored[room_id]
+            if room.engine is not engine:
+                continue
+            room.on_end = room_ended
+            room.log = event_log
+            rooms[room_id] = room
+            # Clients keep their address across a server restart, so they
+            # carry on in their room; sequence numbers start over, so they
+            # get unsequenced messages until they register again
+            for addr in room.clients:
+                room_of[addr] = room
+            if room.game_ended:
+                room_ended(room)
+            elif not room.game_started:
+                lobby = room
+            next_room_id = max(next_room_id, room_id + 1)
+    
+    if rooms:
+        print(f"Recovered {len(rooms)} rooms with {len(room_of)} players from {LOG_DIR}")
+    checkpoint()
+
+def checkpoint():
+    """Start a new log segment with a snapshot of every open room"""
+    with rooms_lock:
+        event_log.start_checkpoint()
+        for room in rooms.values():
+            with room.whole_board_lock(), room.state_lock:
+                event_log.snapshot(room.room_id, room.engine)
+        event_log.end_checkpoint()
+    scheduler.call_later(CHECKPOINT_INTERVAL, checkpoint)
+
+def make_sender(sock):
+    """Wrap the socket in an Outbox, unless coalescing is disabled, and the reliability layer"""
+    if OUTBOX_TICK > 0:
+        outbox = Outbox(sock, scheduler, tick=OUTBOX_TICK)
+        scheduler.call_later(STATS_INTERVAL, report_outbox_stats, outbox)
+        metrics.Gauge("checkbox_outbox_datagrams_total", "Datagrams the outbox sent",
+                      lambda: outbox.datagrams_sent, kind="counter")
+        sock = outbox
+    
+    sender = ReliableSender(sock, scheduler)
+    sender.on_give_up = lambda addr: give_up_on_client(sender, addr)
+    metrics.Gauge("checkbox_retransmits_total", "Sequenced messages sent again",
+                  lambda: sender.retransmits, kind="counter")
+    metrics.Gauge("checkbox_unacked_messages", "Sequenced messages waiting for an ack", sender.unacked)
+    scheduler.call_later(STATS_INTERVAL, report_retransmits, sender, 0)
+    scheduler.call_later(STATS_INTERVAL, report_clients)
+    scheduler.call_later(EVICT_INTERVAL, prune_limiters)
+    if CLIENT_TIMEOUT > 0:
+        scheduler.call_later(EVICT_INTERVAL, evict_idle_clients, sender)
+    return sender
+
+def report_outbox_stats(outbox):
+    """Periodically print how many datagrams the outbox saved"""
+    saved = outbox.saved_per_second()
+    if saved > 0:
+        print(f"Outbox: {outbox.messages_sent} messages in {outbox.datagrams_sent} datagrams, "
+              f"{saved:.1f} datagrams/s saved")
+    scheduler.call_later(STATS_INTERVAL, report_outbox_stats, outbox)
+
+def report_clients():
+    """Periodically print how many clients are connected and how many were evicted"""
+    live, evicted = client_counts()
+    if live or evicted:
+        print(f"Clients: {live} live, {evicted} evicted")
+    scheduler.call_later(STATS_INTERVAL, report_clients)
+
+def report_retransmits(sender, last):
+    """Periodically print how many reliable messages had to be sent again"""
+    if sender.retransmits > last:
+        print(f"Reliable: {sender.retransmits - last} retransmits in the last {STATS_INTERVAL:.0f}s")
+    scheduler.call_later(STATS_INTERVAL, report_retransmits, sender, sender.retransmits)
+
+def receive_loop(sock, sender):
+    while True:
+        try:
+            data, addr = sock.recvfrom(1024)
+            handle_datagram(sender, data, addr)
+        except Exception as e:
+            errors.inc(type(e).__name__)
+            print(f"Error: {e}")
+
+def handle_updates(workers=1):
     with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        if cluster is not None:
+            # Every worker process binds the same port
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         sock.bind((HOST, PORT))
         print("Server listening on port", PORT)
         
-        while True:
-            try:
-                data, addr = sock.recvfrom(1024)
-                msg = data.decode().split(',')
-                
-                if msg[0] == 'register':
-                    global next_id, game_started
-                    client_name = f"Player {next_id}"
-                    next_id += 1
-                    
-                    used_colors = {client_data["color"] for client_data in clients.values()}
-                    available_colors = [c for c in colors if c not in used_colors]
-                    
-                    if not available_colors:
-                        color = random.choice(colors)
-                    else:
-                        color = random.choice(available_colors)
-                    
-                    clients[addr] = {"color": color, "name": client_name}
-                    
-                    # Send grid dimensions to client
-                    grid_msg = f"grid_config,{GRID_ROWS},{GRID_COLS}"
-                    sock.sendto(grid_msg.encode(), addr)
-                    
-                    identity_msg = f"identity,{client_name},{color}"
-                    sock.sendto(identity_msg.encode(), addr)
-                    
-                    # Send player count to all clients
-                    waiting_msg = f"waiting,{len(clients)},{REQUIRED_PLAYERS}"
-                    for c in clients:
-                        sock.sendto(waiting_msg.encode(), c)
-                    
-                    # Check if we have enough players to start
-                    if len(clients) >= REQUIRED_PLAYERS and not game_started:
-                        game_started = True
-                        print(f"Game starting with {len(clients)} players!")
-                        
-                        # Tell all clients to start the game
-                        start_msg = "game_start"
-                        for c in clients:
-                            sock.sendto(start_msg.encode(), c)
-                    
-                    # If game already started, tell the new player
-                    elif game_started:
-                        sock.sendto("game_start".encode(), addr)
-                    
-                    for client_addr, client_data in clients.items():
-                        player_info = f"player_info,{client_data['name']},{client_data['color']}"
-                        for c in clients:
-                            sock.sendto(player_info.encode(), c)
-                    
-                    with board_lock:
-                        board_state = []
-                        for r in range(GRID_ROWS):
-                            for c in range(GRID_COLS):
-                                cell = board[r][c]
-                                if cell is None:
-                                    board_state.append("None,None")
-                                else:
-                                    owner_id = cell
-                                    owner_color = next((client_data["color"] for client_addr, client_data in clients.items() 
-                                                       if client_data["name"] == owner_id), "gray")
-                                    board_state.append(f"{owner_id},{owner_color}")
-                    
-                    sync_msg = "board," + ",".join(board_state)
-                    sock.sendto(sync_msg.encode(), addr)
-                    
-                    for (r, c), selection_info in selecting_cells.items():
-                        sel_addr = selection_info["addr"]
-                        if sel_addr in clients:
-                            sel_color = clients[sel_addr]["color"]
-                            sel_name = clients[sel_addr]["name"]
-                            remain_time = max(0, selection_info["end_time"] - time.time())
-                            sel_msg = f"selecting,{r},{c},{sel_name},{sel_color},{remain_time:.1f}"
-                            sock.sendto(sel_msg.encode(), addr)
-                            
-                            for (temp_r, temp_c), temp_info in temp_blocked_during_selection.items():
-                                if temp_info["selection_cell"] == (r, c):
-                                    block_msg = f"block_adjacent,{temp_r},{temp_c},{sel_name},{sel_color},{remain_time:.1f}"
-                                    sock.sendto(block_msg.encode(), addr)
-                    
-                    for (r, c), block_info in adjacent_blocked_cells.items():
-                        remain_time = max(0, block_info["end_time"] - time.time())
-                        block_msg = f"block_adjacent,{r},{c},{block_info['owner']},{block_info['color']},{remain_time:.1f}"
-                        sock.sendto(block_msg.encode(), addr)
-                    
-                    join_msg = f"player_joined,{client_name},{color}"
-                    for c in clients:
-                        if c != addr:
-                            sock.sendto(join_msg.encode(), c)
-                    
-                elif msg[0] == 'click':
-                    # Check if game has ended
-                    if game_ended:
-                        continue
-                        
-                    if addr not in clients:
-                        continue
-                        
-                    if addr in client_selecting:
-                        continue
-                        
-                    row, col = int(msg[1]), int(msg[2])
-                    
-                    with board_lock:
-                        if (board[row][col] is not None or 
-                            (row, col) in selecting_cells or 
-                            (row, col) in adjacent_blocked_cells or
-                            (row, col) in temp_blocked_during_selection):
-                            continue
-                        
-                        adjacent_in_selection = False
-                        for (sel_row, sel_col) in selecting_cells:
-                            if is_adjacent(row, col, sel_row, sel_col):
-                                adjacent_in_selection = True
-                                break
-                        
-                        if adjacent_in_selection:
-                            continue
-                            
-                        client_name = clients[addr]["name"]
-                        client_color = clients[addr]["color"]
-                        
-                        selection_duration = 3.0
-                        end_time = time.time() + selection_duration
-                        
-                        selecting_cells[(row, col)] = {
-                            "addr": addr, 
-                            "end_time": end_time
-                        }
-                        
-                        client_selecting[addr] = (row, col)
-                        
-                        adjacent_cells = get_adjacent_cells(row, col)
-                        for adj_r, adj_c in adjacent_cells:
-                            if (board[adj_r][adj_c] is None and 
-                                (adj_r, adj_c) not in selecting_cells and
-                                (adj_r, adj_c) not in adjacent_blocked_cells):
-                                
-                                temp_blocked_during_selection[(adj_r, adj_c)] = {
-                                    "selection_cell": (row, col)
-                                }
-                                
-                                block_msg = f"block_adjacent,{adj_r},{adj_c},{client_name},{client_color},{selection_duration}"
-                                for c in clients:
-                                    sock.sendto(block_msg.encode(), c)
-                        
-                        timer = threading.Timer(
-                            selection_duration, 
-                            selection_complete,
-                            args=(sock, row, col, addr)
-                        )
-                        timer.daemon = True
-                        timer.start()
-                        
-                        selecting_msg = f"selecting,{row},{col},{client_name},{client_color},{selection_duration}"
-                        for c in clients:
-                            sock.sendto(selecting_msg.encode(), c)
-                
-                elif msg[0] == 'end_game':
-                    # Client requested to end the game early
-                    if addr in clients and game_started and not game_ended:
-                        client_name = clients[addr]["name"]
-                        end_game(sock, client_name)
-                
-                elif msg[0] == 'disconnect':
-                    if addr in clients:
-                        client_name = clients[addr]["name"]
-                        
-                        if addr in client_selecting:
-                            cell = client_selecting[addr]
-                            if cell in selecting_cells:
-                                clear_temp_blocks_for_selection(sock, cell[0], cell[1])
-                                del selecting_cells[cell]
-                            del client_selecting[addr]
-                        
-                        del clients[addr]
-                        
-                        disconnect_msg = f"player_left,{client_name}"
-                        for c in clients:
-                            sock.sendto(disconnect_msg.encode(), c)
-                        
-                        # Update waiting status if game hasn't started
-                        if not game_started:
-                            waiting_msg = f"waiting,{len(clients)},{REQUIRED_PLAYERS}"
-                            for c in clients:
-                                sock.sendto(waiting_msg.encode(), c)
-                            
-            except Exception as e:
-                print(f"Error: {e}")
+        sender = make_sender(sock)
+        if LOG_DIR is not None:
+            recover_rooms(sender)
+        
+        if cluster is not None:
+            threading.Thread(target=cluster.serve_forwarded,
+                             args=(lambda data, addr, room_id: handle_message(sender, data, addr, room_id),),
+                             daemon=True).start()
+        
+        # Extra receive threads share the socket; the kernel hands each
+        # datagram to one of them
+        for _ in range(workers - 1):
+            threading.Thread(target=receive_loop, args=(sock, sender), daemon=True).start()
+        
+        receive_loop(sock, sender)
+
+class ServerProtocol(asyncio.DatagramProtocol):
+    """Feeds datagrams from the asyncio transport into handle_message"""
+    
+    def connection_made(self, transport):
+        self.transport = transport
+        self.sender = make_sender(transport)
+        if LOG_DIR is not None:
+            recover_rooms(self.sender)
+    
+    def datagram_received(self, data, addr):
+        try:
+            if admit(data, addr):
+                handle_message(self.sender, data, addr)
+        except Exception as e:
+            errors.inc(type(e).__name__)
+            print(f"Error: {e}")
+
+async def serve_asyncio():
+    """Run the whole server on one event loop: receives, timers and sends"""
+    global scheduler, LOCKING
+    
+    loop = asyncio.get_running_loop()
+    scheduler = AsyncioScheduler(loop)
+    # Everything runs on the loop thread, so rooms have nothing to lock against
+    LOCKING = False
+    
+    transport, _ = await loop.create_datagram_endpoint(ServerProtocol, local_addr=(HOST, PORT))
+    print("Server listening on port", PORT, "(asyncio)")
+    
+    try:
+        await asyncio.Event().wait()
+    finally:
+        scheduler.stop()
+        transport.close()
+
+def run_worker(worker_cluster):
+    """Entry point of each worker process started by --processes"""
+    global cluster
+    
+    cluster = worker_cluster
+    scheduler.start()
+    if METRICS_PORT:
+        serve_metrics(METRICS_PORT + cluster.index)
+    try:
+        handle_updates(WORKERS)
+    except KeyboardInterrupt:
+        pass
+
+def serve_metrics(port):
+    metrics.serve(port)
+    print(f"Metrics on http://127.0.0.1:{port}/metrics")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Multiplayer checkbox game server")
+    parser.add_argument("--engine", choices=["threads", "asyncio"], default="threads",
+                        help="threads: receive thread plus timer thread; asyncio: single event loop")
+    parser.add_argument("--rows", type=int, default=GRID_ROWS, help="grid rows of each room")
+    parser.add_argument("--cols", type=int, default=GRID_COLS, help="grid columns of each room")
+    parser.add_argument("--tick-ms", type=float, default=OUTBOX_TICK * 1000,
+                        help="broadcast coalescing window in milliseconds (0 disables batching)")
+    parser.add_argument("--shard-size", type=int, default=0,
+                        help="split the board into tiles of this size, each with its own lock (threads engine)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="receive threads sharing the socket (threads engine)")
+    parser.add_argument("--client-timeout", type=float, default=CLIENT_TIMEOUT,
+                        help="seconds without a message before a client is evicted (0 disables)")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="worker processes sharing the port with SO_REUSEPORT (threads engine)")
+    parser.add_argument("--message-rate", type=float, default=MESSAGE_RATE,
+                        help="datagrams per second allowed from each address, in bursts of twice that (0 disables)")
+    parser.add_argument("--register-rate", type=float, default=REGISTER_RATE,
+                        help="registers per second allowed from each address (0 disables)")
+    parser.add_argument("--max-players", type=int, default=MAX_PLAYERS, help="players per game")
+    parser.add_argument("--max-clients", type=int, default=MAX_CLIENTS, help="players across all games")
+    parser.add_argument("--log-dir", help="keep an event log here and recover its games on startup")
+    parser.add_argument("--checkpoint-interval", type=float, default=CHECKPOINT_INTERVAL,
+                        help="seconds between board snapshots in the event log")
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT,
+                        help="serve Prometheus-style metrics on this local port (0 disables)")
+    return parser.parse_args()
 
 if __name__ == '__main__':
+    args = parse_args()
+    OUTBOX_TICK = args.tick_ms / 1000.0
+    
+    GRID_ROWS, GRID_COLS = args.rows, args.cols
+    SHARD_SIZE = args.shard_size
+    WORKERS = args.workers
+    CLIENT_TIMEOUT = args.client_timeout
+    METRICS_PORT = args.metrics_port
+    MESSAGE_RATE, MESSAGE_BURST = args.message_rate, args.message_rate * 2
+    REGISTER_RATE = args.register_rate
+    if MESSAGE_RATE > 0:
+        message_limiter = RateLimiter(MESSAGE_RATE, MESSAGE_BURST)
+    if REGISTER_RATE > 0:
+        register_limiter = RateLimiter(REGISTER_RATE, REGISTER_BURST)
+    # A game must have room for the players it waits for
+    MAX_PLAYERS = max(args.max_players, REQUIRED_PLAYERS)
+    MAX_CLIENTS = args.max_clients
+    LOG_DIR = args.log_dir
+    CHECKPOINT_INTERVAL = args.checkpoint_interval
+    if LOG_DIR is not None and args.processes > 1:
+        sys.exit("--log-dir is not supported with --processes")
+    
     try:
-        update_thread = threading.Thread(target=handle_updates, daemon=True)
-        update_thread.start()
-        
-        timeout_thread = threading.Thread(target=handle_adjacent_cells_timeout, daemon=True)
-        timeout_thread.start()
+        if METRICS_PORT and args.processes <= 1:
+            serve_metrics(METRICS_PORT)
         
-        selection_timeout_thread = threading.Thread(target=handle_selection_timeout, daemon=True)
-        selection_timeout_thread.start()
-        
-        while True:
-            time.sleep(1)
+        if args.processes > 1:
+            launch(args.processes, run_worker, REQUIRED_PLAYERS,
+                   tempfile.mkdtemp(prefix="checkbox-server-"))
+        elif args.engine == "asyncio":
+            asyncio.run(serve_asyncio())
+        else:
+            scheduler.start()
+            
+            update_thread = threading.Thread(target=handle_updates, args=(WORKERS,), daemon=True)
+            update_thread.start()
+            
+            while True:
+                time.sleep(1)
             
     except KeyboardInterrupt:
         print("Server shutting down")
+        if event_log is not None:
+            event_log.close()
         sys.exit(0)
\ No newline at end of file
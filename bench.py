@@ -0,0 +1,275 @@
+"""Benchmarks for the server's hot paths, without any network.
+
+Each benchmark builds a Room on an in-memory socket that only counts what
+it is sent, with a fixed clock; timed work is driven by calling tick with
+the time the benchmark wants to jump to. Runs are seeded and the best of
+--repeat runs is kept, so results are comparable between commits:
+
+    python bench.py --output before.json
+    ... change something ...
+    python bench.py --output after.json --compare before.json
+
+Benchmarks (per grid size and player count):
+    register          register one player, including the board snapshot
+    snapshot_full     encode a full snapshot with a cold cache
+    click_rejected    click on a cell that is not free
+    click_accepted    start a selection and cancel it again
+    selection_complete  claim a cell and fan the result out to every player
+    timer_expiry      expire one adjacent block
+    scores            calculate_scores, score_list and is_board_full
+"""
+import argparse
+import json
+import platform
+import random
+import subprocess
+import time
+
+from engine import BLOCK_DURATION, SELECTION_DURATION
+from room import Room
+
+GRID_SIZES = [10, 100, 1000]
+PLAYER_COUNTS = [3, 30, 300]
+
+
+class FakeSocket:
+    """Counts datagrams and bytes instead of sending them"""
+
+    def __init__(self):
+        self.datagrams = 0
+        self.bytes = 0
+
+    def sendto(self, data, addr):
+        self.datagrams += 1
+        self.bytes += len(data)
+
+    def send_reliable(self, data, addr, binary=False):
+        self.sendto(data, addr)
+
+    def forget(self, addr):
+        pass
+
+
+class NullScheduler:
+    """Timers never fire; the benchmark calls tick itself"""
+
+    def call_at(self, deadline, callback, *args):
+        return None
+
+    def call_later(self, delay, callback, *args):
+        return None
+
+    def cancel(self, timer):
+        pass
+
+
+START_TIME = 1000.0
+
+
+def make_room(size, players, fill=0.5, seed=0):
+    """A room with players registered and part of the board claimed"""
+    # Clicks do not wait for the game to start, so the room is never started
+    room = Room(1, FakeSocket(), NullScheduler(), size, size, required_players=0xFFFF,
+                clock=lambda: START_TIME)
+    addrs = [("10.0.0.1", 10000 + i) for i in range(players)]
+    for addr in addrs:
+        room.register(addr, binary=True)
+
+    rng = random.Random(seed)
+    ids = [room.clients[addr]["id"] for addr in addrs]
+    for row in range(size):
+        for col in range(size):
+            if rng.random() < fill:
+                room.engine.claim_cell(row, col, rng.choice(ids))
+    return room, addrs
+
+
+def timed(fn, ops):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start, ops
+
+
+def bench_register(size, players, seed):
+    room, _ = make_room(size, players, seed=seed)
+    count = max(10, min(players, 200))
+    addrs = [("10.0.1.1", 20000 + i) for i in range(count)]
+
+    def run():
+        for addr in addrs:
+            room.register(addr, binary=True)
+    return timed(run, count)
+
+
+def bench_snapshot_full(size, players, seed):
+    room, _ = make_room(size, players, seed=seed)
+    count = 20 if size <= 100 else 3
+
+    def run():
+        for _ in range(count):
+            room.engine.snapshots._cache.clear()
+            room.engine.snapshots.build(room.engine.board, room.players.info)
+    return timed(run, count)
+
+
+def _free_and_taken(room):
+    board = room.engine.board
+    free = [(r, c) for r in range(room.rows) for c in range(room.cols) if board[r][c] is None]
+    taken = [(r, c) for r in range(room.rows) for c in range(room.cols) if board[r][c] is not None]
+    return free, taken
+
+
+def bench_click_rejected(size, players, seed):
+    room, addrs = make_room(size, players, seed=seed)
+    rng = random.Random(seed)
+    _, taken = _free_and_taken(room)
+    count = 20000
+    clicks = [(rng.choice(addrs), rng.choice(taken)) for _ in range(count)]
+
+    def run():
+        for addr, (row, col) in clicks:
+            room.click(addr, row, col)
+    return timed(run, count)
+
+
+def bench_click_accepted(size, players, seed):
+    room, addrs = make_room(size, players, seed=seed)
+    rng = random.Random(seed)
+    free, _ = _free_and_taken(room)
+    count = 5000
+    clicks = [(rng.choice(addrs), rng.choice(free)) for _ in range(count)]
+
+    def run():
+        for addr, (row, col) in clicks:
+            room.click(addr, row, col)
+            room.dispatch(room.engine.cancel_selection(row, col))
+    return timed(run, count)
+
+
+def start_selections(room, addrs, count, seed):
+    """Start up to count selections on an empty board, one player at a time"""
+    engine = room.engine
+    rng = random.Random(seed)
+    cells = [(r, c) for r in range(room.rows) for c in range(room.cols)]
+    rng.shuffle(cells)
+
+    started = 0
+    for (row, col) in cells:
+        if started == count:
+            break
+        addr = addrs[started % len(addrs)]
+        engine.client_selecting.pop(addr, None)
+        room.click(addr, row, col)
+        if engine.selecting_cells.get((row, col), {}).get("addr") == addr:
+            started += 1
+    return started
+
+
+def bench_selection_complete(size, players, seed):
+    room, addrs = make_room(size, players, fill=0.0, seed=seed)
+    # Start the selections up front so only the completions are timed
+    started = start_selections(room, addrs, min(2000, size * size // 2), seed)
+    return timed(lambda: room.tick(START_TIME + SELECTION_DURATION), max(1, started))
+
+
+def bench_timer_expiry(size, players, seed):
+    room, addrs = make_room(size, players, fill=0.0, seed=seed)
+    start_selections(room, addrs, min(2000, size * size // 4), seed)
+    room.tick(START_TIME + SELECTION_DURATION)
+
+    # Every block ends at the same deadline; the scores broadcast falls before it
+    blocks = len(room.engine.adjacent_blocked_cells)
+    return timed(lambda: room.tick(START_TIME + SELECTION_DURATION + BLOCK_DURATION), max(1, blocks))
+
+
+def bench_scores(size, players, seed):
+    room, _ = make_room(size, players, seed=seed)
+    count = 20000
+
+    def run():
+        for _ in range(count):
+            room.engine.calculate_scores()
+            room.engine.score_list()
+            room.engine.is_board_full()
+    return timed(run, count)
+
+
+BENCHMARKS = {
+    "register": bench_register,
+    "snapshot_full": bench_snapshot_full,
+    "click_rejected": bench_click_rejected,
+    "click_accepted": bench_click_accepted,
+    "selection_complete": bench_selection_complete,
+    "timer_expiry": bench_timer_expiry,
+    "scores": bench_scores,
+}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(names, sizes, player_counts, repeat, seed):
+    results = []
+    for name in names:
+        for size in sizes:
+            for players in player_counts:
+                best = None
+                for _ in range(repeat):
+                    seconds, ops = BENCHMARKS[name](size, players, seed)
+                    per_op = seconds / ops
+                    if best is None or per_op < best[0]:
+                        best = (per_op, ops)
+                result = {"bench": name, "rows": size, "cols": size, "players": players,
+                          "ops": best[1], "us_per_op": round(best[0] * 1e6, 3)}
+                results.append(result)
+                print(f"{name:<20}{size:>6}x{size:<6}{players:>8}{result['us_per_op']:>14.2f}", flush=True)
+    return results
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {(r["bench"], r["rows"], r["cols"], r["players"]): r for r in json.load(f)["results"]}
+
+    print(f"\n{'bench':<20}{'grid':>13}{'players':>8}{'before':>12}{'after':>12}{'change':>9}")
+    for result in results:
+        old = baseline.get((result["bench"], result["rows"], result["cols"], result["players"]))
+        if old is None:
+            continue
+        change = (result["us_per_op"] / old["us_per_op"] - 1) * 100 if old["us_per_op"] else 0.0
+        grid = f"{result['rows']}x{result['cols']}"
+        print(f"{result['bench']:<20}{grid:>13}{result['players']:>8}"
+              f"{old['us_per_op']:>12.2f}{result['us_per_op']:>12.2f}{change:>+8.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bench", nargs="+", choices=sorted(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument("--sizes", type=int, nargs="+", default=GRID_SIZES, help="square grid sizes")
+    parser.add_argument("--players", type=int, nargs="+", default=PLAYER_COUNTS)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case; the fastest is kept")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    print(f"{'bench':<20}{'grid':>13}{'players':>8}{'us/op':>14}")
+    results = run_suite(args.bench, args.sizes, args.players, args.repeat, args.seed)
+
+    if args.output:
+        report = {"commit": git_commit(), "python": platform.python_version(),
+                  "machine": platform.machine(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                  "results": results}
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
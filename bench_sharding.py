@@ -0,0 +1,90 @@
+"""Click throughput with one global board lock versus a sharded board.
+
+Drives a Room's click and completion paths directly from several
+threads on a large grid. Sends go to bench.py's socket stand-in, which
+only counts them, and timers are not scheduled; completions run right
+after a successful click. Tile locks only turn into a speed-up on an
+interpreter without a GIL (e.g. a free-threaded 3.13 build); with the
+GIL the threads still take turns. Example:
+
+    python bench_sharding.py --rows 2000 --cols 2000 --threads 1 2 4 8
+"""
+import argparse
+import random
+import sys
+import threading
+import time
+
+from bench import FakeSocket, NullScheduler
+from room import Room
+
+
+def worker(room, addrs, rows, cols, stop, counts, index, seed):
+    rng = random.Random(seed)
+    clicks = 0
+    claims = 0
+
+    while not stop.is_set():
+        addr = rng.choice(addrs)
+        row, col = rng.randrange(rows), rng.randrange(cols)
+        room.click(addr, row, col)
+        clicks += 1
+
+        if room.engine.client_selecting.get(addr) == (row, col):
+            room.selection_complete(row, col, addr)
+            claims += 1
+
+    counts[index] = (clicks, claims)
+
+
+def run(rows, cols, shard_size, threads, total_players, duration):
+    room = Room(1, FakeSocket(), NullScheduler(), rows, cols, total_players, shard_size=shard_size)
+
+    # The same number of players in every run keeps the broadcast fan-out constant
+    addrs = [("10.0.0.1", 10000 + i) for i in range(total_players)]
+    for addr in addrs:
+        room.register(addr)
+    thread_addrs = [addrs[t::threads] for t in range(threads)]
+
+    stop = threading.Event()
+    counts = [None] * threads
+    pool = [threading.Thread(target=worker,
+                             args=(room, thread_addrs[t], rows, cols, stop, counts, t, t))
+            for t in range(threads)]
+
+    start = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    clicks = sum(c[0] for c in counts)
+    claims = sum(c[1] for c in counts)
+    return clicks / elapsed, claims / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--cols", type=int, default=2000)
+    parser.add_argument("--shard-size", type=int, default=64)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--players", type=int, default=32, help="players split across the threads")
+    parser.add_argument("--duration", type=float, default=2.0, help="seconds per run")
+    args = parser.parse_args()
+
+    gil = sys._is_gil_enabled() if hasattr(sys, "_is_gil_enabled") else True
+    print(f"{args.rows}x{args.cols} grid, {args.players} players, {args.duration:.1f}s per run, "
+          f"GIL {'enabled' if gil else 'disabled'}")
+    print(f"{'mode':<16}{'threads':>8}{'clicks/s':>12}{'claims/s':>12}")
+    for mode, shard_size in (("global lock", 0), (f"tiles {args.shard_size}", args.shard_size)):
+        for threads in args.threads:
+            clicks, claims = run(args.rows, args.cols, shard_size, threads, args.players, args.duration)
+            print(f"{mode:<16}{threads:>8}{clicks:>12.0f}{claims:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
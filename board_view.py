@@ -0,0 +1,237 @@
+import tkinter as tk
+
+CELL_SIZE = 50              # Pixels per cell before any zoom
+MIN_CELL_SIZE = 1
+MAX_CELL_SIZE = 100
+ZOOM_STEP = 1.25
+
+# Below this many pixels per cell the cells in view are painted into one
+# image rather than drawn as an item each, and text is not shown below
+# TEXT_CELL_SIZE
+IMAGE_CELL_SIZE = 8
+TEXT_CELL_SIZE = 24
+
+# Largest initial size of the view; bigger boards scroll
+MAX_VIEW_WIDTH = 800
+MAX_VIEW_HEIGHT = 600
+
+
+class BoardView:
+    """The board drawn on a single Canvas that can be scrolled and zoomed.
+
+    Only the cells in view have canvas items. Items are created and deleted
+    as the view moves, so the item count follows the window size rather than
+    the board size. style(row, col) returns a cell's (fill colour, text) and
+    is asked again whenever the cell is refreshed. Clicks are hit-tested
+    from their coordinates and passed to on_click(row, col).
+    """
+
+    def __init__(self, parent, rows, cols, style, on_click, cell_size=CELL_SIZE):
+        self.rows = rows
+        self.cols = cols
+        self.style = style
+        self.on_click = on_click
+        self.cell_size = cell_size
+
+        self.frame = tk.Frame(parent)
+        self.canvas = tk.Canvas(
+            self.frame,
+            width=min(cols * cell_size, MAX_VIEW_WIDTH),
+            height=min(rows * cell_size, MAX_VIEW_HEIGHT),
+            background="white",
+            highlightthickness=0,
+            xscrollcommand=self.on_xscroll,
+            yscrollcommand=self.on_yscroll
+        )
+        self.xbar = tk.Scrollbar(self.frame, orient=tk.HORIZONTAL, command=self.canvas.xview)
+        self.ybar = tk.Scrollbar(self.frame, orient=tk.VERTICAL, command=self.canvas.yview)
+        self.canvas.grid(row=0, column=0, sticky="nsew")
+        self.ybar.grid(row=0, column=1, sticky="ns")
+        self.xbar.grid(row=1, column=0, sticky="ew")
+        self.frame.rowconfigure(0, weight=1)
+        self.frame.columnconfigure(0, weight=1)
+
+        self.items = {}             # (row, col) -> [rectangle, text or None] for the cells in view
+        self.view = (0, 0, 0, 0)    # first row, end row, first col, end col of the cells drawn
+        self.image = None           # PhotoImage of the cells in view when zoomed far out
+        self.redraw_pending = False
+        self.hex_colors = {}        # colour name -> "#rrggbb", for painting images
+
+        self.canvas.bind("<Button-1>", self.click)
+        self.canvas.bind("<Configure>", lambda event: self.schedule_redraw())
+        self.canvas.bind("<MouseWheel>", lambda event: self.scroll(event, self.canvas.yview_scroll))
+        self.canvas.bind("<Shift-MouseWheel>", lambda event: self.scroll(event, self.canvas.xview_scroll))
+        self.canvas.bind("<Button-4>", lambda event: self.canvas.yview_scroll(-1, "units"))
+        self.canvas.bind("<Button-5>", lambda event: self.canvas.yview_scroll(1, "units"))
+        self.canvas.bind("<Control-MouseWheel>",
+                         lambda event: self.zoom(ZOOM_STEP if event.delta > 0 else 1 / ZOOM_STEP, event.x, event.y))
+        self.canvas.bind("<Control-Button-4>", lambda event: self.zoom(ZOOM_STEP, event.x, event.y))
+        self.canvas.bind("<Control-Button-5>", lambda event: self.zoom(1 / ZOOM_STEP, event.x, event.y))
+        self.canvas.bind("<plus>", lambda event: self.zoom(ZOOM_STEP))
+        self.canvas.bind("<equal>", lambda event: self.zoom(ZOOM_STEP))
+        self.canvas.bind("<minus>", lambda event: self.zoom(1 / ZOOM_STEP))
+
+        self.set_scrollregion()
+        self.schedule_redraw()
+
+    def destroy(self):
+        self.frame.destroy()
+
+    def set_scrollregion(self):
+        size = self.cell_size
+        self.canvas.config(scrollregion=(0, 0, self.cols * size, self.rows * size),
+                           xscrollincrement=size, yscrollincrement=size)
+
+    def on_xscroll(self, first, last):
+        self.xbar.set(first, last)
+        self.schedule_redraw()
+
+    def on_yscroll(self, first, last):
+        self.ybar.set(first, last)
+        self.schedule_redraw()
+
+    def scroll(self, event, scroll):
+        scroll(-1 if event.delta > 0 else 1, "units")
+
+    def zoom(self, factor, x=None, y=None):
+        """Change the cell size, keeping the board point under (x, y) in place"""
+        if x is None:
+            x, y = self.canvas.winfo_width() / 2, self.canvas.winfo_height() / 2
+        old = self.cell_size
+        new = max(MIN_CELL_SIZE, min(MAX_CELL_SIZE, round(old * factor)))
+        if new == old:
+            new = max(MIN_CELL_SIZE, min(MAX_CELL_SIZE, old + (1 if factor > 1 else -1)))
+            if new == old:
+                return
+
+        # Board position under the pointer, in cells
+        board_x = self.canvas.canvasx(x) / old
+        board_y = self.canvas.canvasy(y) / old
+
+        # Every item sits at the old scale, so start the drawing over
+        self.canvas.delete("all")
+        self.items.clear()
+        self.image = None
+        self.cell_size = new
+        self.set_scrollregion()
+        self.canvas.xview_moveto(max(0, board_x * new - x) / (self.cols * new))
+        self.canvas.yview_moveto(max(0, board_y * new - y) / (self.rows * new))
+        self.schedule_redraw()
+
+    def click(self, event):
+        self.canvas.focus_set()
+        row = int(self.canvas.canvasy(event.y) // self.cell_size)
+        col = int(self.canvas.canvasx(event.x) // self.cell_size)
+        if 0 <= row < self.rows and 0 <= col < self.cols:
+            self.on_click(row, col)
+
+    def visible_range(self):
+        """First row, end row, first col and end col of the cells in view"""
+        size = self.cell_size
+        left = self.canvas.canvasx(0)
+        top = self.canvas.canvasy(0)
+        width = max(self.canvas.winfo_width(), int(self.canvas["width"]))
+        height = max(self.canvas.winfo_height(), int(self.canvas["height"]))
+        return (max(0, int(top // size)), min(self.rows, int((top + height) // size) + 1),
+                max(0, int(left // size)), min(self.cols, int((left + width) // size) + 1))
+
+    def schedule_redraw(self):
+        """Bring the drawn cells in line with the view once Tk is idle"""
+        if not self.redraw_pending:
+            self.redraw_pending = True
+            self.canvas.after_idle(self.redraw)
+
+    def redraw(self):
+        self.redraw_pending = False
+        first_row, end_row, first_col, end_col = view = self.visible_range()
+
+        if self.cell_size < IMAGE_CELL_SIZE:
+            if view != self.view or self.image is None:
+                self.view = view
+                self.paint_image()
+            return
+
+        for cell in [cell for cell in self.items
+                     if not (first_row <= cell[0] < end_row and first_col <= cell[1] < end_col)]:
+            for item in self.items.pop(cell):
+                if item is not None:
+                    self.canvas.delete(item)
+
+        for row in range(first_row, end_row):
+            for col in range(first_col, end_col):
+                if (row, col) not in self.items:
+                    self.draw_cell(row, col)
+        self.view = view
+
+    def draw_cell(self, row, col):
+        size = self.cell_size
+        x, y = col * size, row * size
+        fill, text = self.style(row, col)
+        rectangle = self.canvas.create_rectangle(x, y, x + size, y + size, fill=fill, outline="black")
+        self.items[(row, col)] = [rectangle, None]
+        if text:
+            self.set_text(row, col, text)
+
+    def set_text(self, row, col, text):
+        item = self.items[(row, col)]
+        if not text or self.cell_size < TEXT_CELL_SIZE:
+            if item[1] is not None:
+                self.canvas.delete(item[1])
+                item[1] = None
+        elif item[1] is None:
+            size = self.cell_size
+            item[1] = self.canvas.create_text(col * size + size / 2, row * size + size / 2,
+                                              text=text, font=("Arial", max(6, size // 5)))
+        else:
+            self.canvas.itemconfig(item[1], text=text)
+
+    def refresh(self, row, col):
+        """Redraw one cell from its current style, if it is in view"""
+        if self.image is not None:
+            first_row, end_row, first_col, end_col = self.view
+            if first_row <= row < end_row and first_col <= col < end_col:
+                size = self.cell_size
+                x, y = (col - first_col) * size, (row - first_row) * size
+                self.image.put(self.hex_color(self.style(row, col)[0]), to=(x, y, x + size, y + size))
+            return
+
+        item = self.items.get((row, col))
+        if item is None:
+            return
+        fill, text = self.style(row, col)
+        self.canvas.itemconfig(item[0], fill=fill)
+        self.set_text(row, col, text)
+
+    def refresh_all(self):
+        """Redraw every cell in view"""
+        if self.image is not None:
+            self.paint_image()
+            return
+        for row, col in list(self.items):
+            self.refresh(row, col)
+
+    def paint_image(self):
+        """Paint the cells in view into one image, a pixel block per cell"""
+        first_row, end_row, first_col, end_col = self.view
+        size = self.cell_size
+        width, height = (end_col - first_col) * size, (end_row - first_row) * size
+        if width <= 0 or height <= 0:
+            return
+
+        self.canvas.delete("all")
+        self.items.clear()
+        self.image = tk.PhotoImage(width=width, height=height)
+        lines = []
+        for row in range(first_row, end_row):
+            line = "{" + " ".join(" ".join([self.hex_color(self.style(row, col)[0])] * size)
+                                  for col in range(first_col, end_col)) + "}"
+            lines.extend([line] * size)
+        self.image.put(" ".join(lines), to=(0, 0))
+        self.canvas.create_image(first_col * size, first_row * size, image=self.image, anchor=tk.NW)
+
+    def hex_color(self, color):
+        value = self.hex_colors.get(color)
+        if value is None:
+            red, green, blue = self.canvas.winfo_rgb(color)
+            value = self.hex_colors[color] = f"#{red >> 8:02x}{green >> 8:02x}{blue >> 8:02x}"
+        return value
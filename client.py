@@ -3,6 +3,15 @@ import socket
 import threading
 import sys
 import time
+import base64
+import queue
+import heapq
+import itertools
+import math
+
+import protocol
+import snapshot
+from board_view import BoardView
 
 SERVER_IP = sys.argv[1] if len(sys.argv) > 1 else '127.0.0.1'
 SERVER_PORT = 5005
@@ -11,6 +20,35 @@ SERVER_PORT = 5005
 GRID_ROWS = 10
 GRID_COLS = 10
 
+# How long to wait for the rest of a board snapshot before asking for missing chunks
+SNAPSHOT_RESEND_MS = 500
+
+# Most chunk numbers asked for in one board_resend, so the request fits the
+# server's 1024-byte receive buffer (2 bytes each in binary, up to 6 in text)
+MAX_RESEND_SEQS = {True: 490, False: 160}
+
+# Most out-of-order sequence numbers reported in one ack
+MAX_SELECTIVE_ACKS = 32
+
+# Keepalive interval; the server evicts clients it has not heard from in a while
+HEARTBEAT_MS = 2000
+
+# Shortest time between board redraws; cell changes in between are coalesced
+FRAME_MS = 1000 // 30
+
+# Messages waiting for the Tk thread; when full the listener stops reading
+# the socket until the GUI catches up
+UI_QUEUE_SIZE = 10000
+
+# Blocked cells blink only on boards up to this size, so big boards do not
+# animate thousands of cells; BLINK = False turns blinking off altogether
+BLINK = True
+BLINK_MAX_CELLS = 10000
+
+# How often the Tk thread takes messages off the queue, and for how long at most
+PUMP_MS = 10
+PUMP_BUDGET = 0.008
+
 class CheckBoxClient:
     def __init__(self, root):
         self.root = root
@@ -19,10 +57,25 @@ class CheckBoxClient:
         
         self.player_name = None
         self.player_color = None
+        self.room_id = None
         
         self.player_colors = {}
         self.player_scores = {}
         
+        # Binary protocol state: switched on once the server answers in binary
+        self.binary = False
+        self.players_by_id = {}
+        
+        # Decoded messages from the listener thread; only the Tk thread
+        # handles them, since Tk must not be called from other threads
+        self.events = queue.Queue(UI_QUEUE_SIZE)
+        
+        # Sequenced delivery: next sequence number due, messages that arrived
+        # early, and how far gaps have already been reported
+        self.expected_seq = 1
+        self.out_of_order = {}
+        self.nacked_up_to = 0
+        
         self.is_selecting = False
         self.game_ended = False
         
@@ -37,8 +90,27 @@ class CheckBoxClient:
         
         self.blocked_cells = {}
         self.blink_interval = 200
+        self.blink = BLINK
+        
+        # Animation deadlines (time, order, cell, info) for selecting and blocked
+        # cells, and the one timer set for the earliest of them
+        self.animations = []
+        self.animation_order = itertools.count()
+        self.animation_timer = None
         
         self.blocked_by_selection = {}
+        self.selection_of = {}      # player -> cell of their selection in progress
+        
+        # Cells to redraw at the next frame, or all of them after a full snapshot
+        self.dirty_cells = set()
+        self.redraw_all = False
+        self.frame_pending = False
+        self.last_frame = 0.0
+        
+        # Board snapshot reassembly: (kind, version, base) -> {"total": n, "chunks": {seq: data}}
+        self.board_version = 0
+        self.board_synced = False
+        self.snapshot_parts = {}
         
         # Create waiting screen
         self.waiting_frame = tk.Frame(root, padx=20, pady=20)
@@ -61,7 +133,7 @@ class CheckBoxClient:
         
         # We'll create the grid when we receive grid dimensions from server
         self.grid_frame = tk.Frame(root)
-        self.checkboxes = None  # Will be initialized after grid dimensions are received
+        self.board_view = None  # Will be initialized after grid dimensions are received
         
         self.info_frame = tk.Frame(root)
         
@@ -129,42 +201,30 @@ class CheckBoxClient:
         
         # Connect to server
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.sock.sendto("register".encode(), (SERVER_IP, SERVER_PORT))
+        self.sock.sendto(f"register,{protocol.BINARY_TAG},{protocol.RELIABLE_TAG}".encode(),
+                         (SERVER_IP, SERVER_PORT))
         
         self.listener = threading.Thread(target=self.listen_for_updates, daemon=True)
         self.listener.start()
+        
+        self.root.after(HEARTBEAT_MS, self.send_heartbeat)
+        self.root.after(PUMP_MS, self.pump_events)
     
     def initialize_grid(self):
         """Initialize the game grid with current dimensions"""
-        self.checkboxes = [[None for _ in range(self.grid_cols)] for _ in range(self.grid_rows)]
-        
-        for r in range(self.grid_rows):
-            for c in range(self.grid_cols):
-                cell_frame = tk.Frame(self.grid_frame, width=50, height=50, 
-                                     borderwidth=1, relief="solid")
-                cell_frame.grid(row=r, column=c)
-                cell_frame.grid_propagate(False)
-                
-                cb = tk.Checkbutton(cell_frame, command=lambda row=r, col=c: self.handle_click(row, col))
-                cb.place(relx=0.5, rely=0.5, anchor=tk.CENTER)
-                
-                timer_label = tk.Label(cell_frame, text="", font=("Arial", 6))
-                timer_label.place(relx=0.5, rely=0.8, anchor=tk.CENTER)
-                
-                self.checkboxes[r][c] = {
-                    "checkbox": cb, 
-                    "frame": cell_frame,
-                    "timer_label": timer_label
-                }
-        
-        # Start the timers after grid is initialized
-        self.update_timers()
-        self.update_blocked_cells_blink()
+        if self.board_view is not None:
+            self.board_view.destroy()
+        self.blink = BLINK and self.grid_rows * self.grid_cols <= BLINK_MAX_CELLS
+        
+        # One canvas for the whole board; only the cells in view are drawn
+        self.board_view = BoardView(self.grid_frame, self.grid_rows, self.grid_cols,
+                                    self.cell_style, self.handle_click)
+        self.board_view.frame.pack(fill=tk.BOTH, expand=True)
     
     def start_game(self):
         """Switch from waiting screen to game board"""
         self.waiting_frame.pack_forget()
-        self.grid_frame.pack(padx=10, pady=10)
+        self.grid_frame.pack(padx=10, pady=10, fill=tk.BOTH, expand=True)
         self.info_frame.pack(pady=10)
         self.update_all_cells()
     
@@ -173,14 +233,22 @@ class CheckBoxClient:
         if self.is_selecting or self.game_ended:
             return
             
-        msg = f"click,{row},{col}"
-        self.sock.sendto(msg.encode(), (SERVER_IP, SERVER_PORT))
+        self.send("click", row, col)
     
     def request_end_game(self):
         """Send request to end the game early"""
         if not self.game_ended:
-            msg = "end_game"
-            self.sock.sendto(msg.encode(), (SERVER_IP, SERVER_PORT))
+            self.send("end_game")
+    
+    def send(self, name, *fields):
+        """Send a message to the server in the negotiated protocol"""
+        data = protocol.encode(name, fields, self.binary)
+        self.sock.sendto(data, (SERVER_IP, SERVER_PORT))
+    
+    def send_heartbeat(self):
+        """Tell the server we are still here"""
+        self.send("heartbeat")
+        self.root.after(HEARTBEAT_MS, self.send_heartbeat)
     
     def show_results(self, winners, scores, ended_by=None):
         """Show the game results screen"""
@@ -252,66 +320,69 @@ class CheckBoxClient:
     def update_status(self, message):
         self.status_label.config(text=message)
     
-    def update_timers(self):
-        current_time = time.time()
-        cells_to_remove = []
-        
-        for (row, col), info in self.selecting_cells.items():
-            remaining = max(0, info["end_time"] - current_time)
-            
-            if remaining > 0:
-                bg_color = info["color"]
-                
-                frame = self.checkboxes[row][col]["frame"]
-                frame.config(background=bg_color)
-                
-                timer_label = self.checkboxes[row][col]["timer_label"]
-                timer_label.config(text=f"{remaining:.1f}s")
-                
-                if info["player"] == self.player_name:
-                    self.update_status(f"Selecting cell... {remaining:.1f}s")
-            else:
-                cells_to_remove.append((row, col))
-                timer_label = self.checkboxes[row][col]["timer_label"]
-                timer_label.config(text="")
-                
-                if info["player"] == self.player_name:
-                    self.is_selecting = False
-                    self.update_status("")
-        
-        for cell in cells_to_remove:
-            if cell in self.selecting_cells:
-                del self.selecting_cells[cell]
-        
-        self.root.after(100, self.update_timers)
+    def animate_at(self, when, cell, info):
+        """Have animate look at a selecting or blocked cell again at time when"""
+        heapq.heappush(self.animations, (when, next(self.animation_order), cell, info))
+        self.schedule_animation()
+    
+    def schedule_animation(self):
+        """Keep one timer set for the earliest animation, or none when nothing animates"""
+        if not self.selecting_cells and not self.blocked_cells:
+            self.animations.clear()
+        
+        when = self.animations[0][0] if self.animations else None
+        if self.animation_timer is not None:
+            if when is not None and self.animation_timer[0] <= when:
+                return
+            self.root.after_cancel(self.animation_timer[1])
+            self.animation_timer = None
+        
+        if when is not None:
+            # Rounded up, so the timer never fires before anything is due
+            delay = max(0, math.ceil((when - time.time()) * 1000))
+            self.animation_timer = (when, self.root.after(delay, self.animate))
     
-    def update_blocked_cells_blink(self):
-        cells_to_remove = []
-        current_time = time.time()
+    def animate(self):
+        """Advance the countdowns and blinks that are due, redrawing only those cells"""
+        self.animation_timer = None
+        now = time.time()
         
-        for (row, col), info in self.blocked_cells.items():
-            info["blink_state"] = not info["blink_state"]
+        while self.animations and self.animations[0][0] <= now:
+            _, _, cell, info = heapq.heappop(self.animations)
             
-            if current_time > info["end_time"]:
-                cells_to_remove.append((row, col))
-                self.checkboxes[row][col]["frame"].config(background="white")
-                
-                if (row, col) in self.blocked_by_selection:
-                    del self.blocked_by_selection[(row, col)]
-                continue
-                
-            if info["blink_state"]:
-                self.checkboxes[row][col]["frame"].config(background=info["color"])
-            else:
-                lighter_color = self.get_lighter_color(info["color"])
-                self.checkboxes[row][col]["frame"].config(background=lighter_color)
-        
-        for cell in cells_to_remove:
-            if cell in self.blocked_cells:
-                del self.blocked_cells[cell]
+            if self.selecting_cells.get(cell) is info:
+                remaining = info["end_time"] - now
+                if remaining <= 0:
+                    self.remove_selection(cell)
+                    if info["player"] == self.player_name:
+                        self.is_selecting = False
+                        self.update_status("")
+                else:
+                    if info["player"] == self.player_name:
+                        self.update_status(f"Selecting cell... {remaining:.1f}s")
+                    heapq.heappush(self.animations, (self.next_countdown_change(info, now),
+                                                     next(self.animation_order), cell, info))
+                self.update_cell_appearance(cell[0], cell[1])
+            
+            elif self.blocked_cells.get(cell) is info:
+                if now > info["end_time"]:
+                    del self.blocked_cells[cell]
+                    if cell in self.blocked_by_selection:
+                        del self.blocked_by_selection[cell]
+                else:
+                    info["blink_state"] = not info["blink_state"]
+                    when = min(now + self.blink_interval / 1000, info["end_time"] + 0.001)
+                    heapq.heappush(self.animations, (when, next(self.animation_order), cell, info))
                 self.update_cell_appearance(cell[0], cell[1])
         
-        self.root.after(self.blink_interval, self.update_blocked_cells_blink)
+        self.schedule_animation()
+    
+    def next_countdown_change(self, info, now):
+        """When a countdown's text (tenths of a second) next changes"""
+        remaining = info["end_time"] - now
+        # The text rounds to tenths, so it changes as remaining crosses x.x5
+        change = info["end_time"] - (round(remaining, 1) - 0.05)
+        return change if change > now else change + 0.1
     
     def get_lighter_color(self, color):
         color_map = {
@@ -334,251 +405,433 @@ class CheckBoxClient:
             color_indicator = tk.Frame(player_frame, width=15, height=15, bg=color)
             color_indicator.pack(side=tk.LEFT, padx=5)
             
-            name_label = tk.Label(player_frame, text=player)
+            text = player
+            if player in self.player_scores:
+                text = f"{player} ({self.player_scores[player]})"
+            
+            name_label = tk.Label(player_frame, text=text)
             name_label.pack(side=tk.LEFT)
     
-    def update_cell_appearance(self, row, col):
-        owner = self.board_owners[row][col]
-        color = self.board_colors[row][col]
-        
-        if (row, col) in self.blocked_cells:
-            self.checkboxes[row][col]["checkbox"].config(state=tk.DISABLED)
+    def cell_style(self, row, col):
+        """Fill colour and text of a cell, as the board view draws it"""
+        blocked = self.blocked_cells.get((row, col))
+        if blocked is not None:
+            if blocked["blink_state"]:
+                return blocked["color"], ""
+            return self.get_lighter_color(blocked["color"]), ""
+        
+        selecting = self.selecting_cells.get((row, col))
+        if selecting is not None:
+            remaining = max(0, selecting["end_time"] - time.time())
+            return selecting["color"], f"{remaining:.1f}s"
+        
+        if self.board_owners[row][col] is not None:
+            return self.board_colors[row][col], "\u2713"
+        
+        return "white", ""
+    
+    def update_cell_appearance(self, row, col, neighbors=False):
+        """Mark a cell, and optionally its neighbors, for redrawing at the next frame"""
+        self.dirty_cells.add((row, col))
+        if neighbors:
+            self.dirty_cells.update(((row - 1, col), (row + 1, col), (row, col - 1), (row, col + 1)))
+        self.schedule_frame()
+    
+    def update_all_cells(self):
+        """Mark every cell in view for redrawing at the next frame"""
+        self.redraw_all = True
+        self.schedule_frame()
+    
+    def schedule_frame(self):
+        """Make sure a frame is drawn, but no sooner than FRAME_MS after the last one"""
+        if self.frame_pending:
             return
-            
-        elif (row, col) in self.selecting_cells:
-            sel_color = self.selecting_cells[(row, col)]["color"]
-            self.checkboxes[row][col]["frame"].config(background=sel_color)
-            self.checkboxes[row][col]["checkbox"].config(state=tk.DISABLED)
+        self.frame_pending = True
+        wait = self.last_frame + FRAME_MS / 1000 - time.time()
+        self.root.after(max(0, int(wait * 1000)), self.render_frame)
+    
+    def render_frame(self):
+        """Redraw the cells that changed since the last frame"""
+        self.frame_pending = False
+        self.last_frame = time.time()
+        dirty, self.dirty_cells = self.dirty_cells, set()
+        redraw_all, self.redraw_all = self.redraw_all, False
+        
+        if self.board_view is None:
             return
-            
-        elif owner is not None:
-            self.checkboxes[row][col]["frame"].config(background=color)
-            self.checkboxes[row][col]["checkbox"].select()
-            self.checkboxes[row][col]["checkbox"].config(state=tk.DISABLED)
+        if redraw_all:
+            self.board_view.refresh_all()
             return
+        for row, col in dirty:
+            if 0 <= row < self.grid_rows and 0 <= col < self.grid_cols:
+                self.board_view.refresh(row, col)
+    
+    def pump_events(self):
+        """Handle queued messages on the Tk thread, for at most PUMP_BUDGET at a time"""
+        deadline = time.perf_counter() + PUMP_BUDGET
+        backlog = False
+        while True:
+            if time.perf_counter() >= deadline:
+                backlog = True
+                break
+            try:
+                msg = self.events.get_nowait()
+            except queue.Empty:
+                break
             
-        else:
-            self.checkboxes[row][col]["frame"].config(background="white")
-            self.checkboxes[row][col]["checkbox"].deselect()
-            
-            if self.is_selecting:
-                self.checkboxes[row][col]["checkbox"].config(state=tk.DISABLED)
-            else:
-                self.checkboxes[row][col]["checkbox"].config(state=tk.NORMAL)
+            try:
+                self.handle_message(msg)
+            except Exception as e:
+                print(f"Error handling {msg[0]}: {e}")
+        
+        # With a backlog, come straight back after Tk has redrawn and read input
+        self.root.after(1 if backlog else PUMP_MS, self.pump_events)
     
-    def update_all_cells(self):
-        """Update the appearance of all cells"""
-        for r in range(self.grid_rows):
-            for c in range(self.grid_cols):
-                self.update_cell_appearance(r, c)
+    def post(self, msg):
+        """Queue a message for the Tk thread, waiting while the queue is full"""
+        self.events.put(msg)
     
     def listen_for_updates(self):
+        """Read and decode datagrams on the listener thread and queue their messages"""
         while True:
             try:
-                data, _ = self.sock.recvfrom(1024)
-                msg = data.decode().split(',')
-                
-                if msg[0] == 'grid_config':
-                    # Update grid dimensions
-                    self.grid_rows = int(msg[1])
-                    self.grid_cols = int(msg[2])
-                    
-                    # Re-initialize board arrays with new dimensions
-                    self.board_owners = [[None for _ in range(self.grid_cols)] for _ in range(self.grid_rows)]
-                    self.board_colors = [[None for _ in range(self.grid_cols)] for _ in range(self.grid_rows)]
-                    
-                    # Initialize the grid UI
-                    self.initialize_grid()
-                
-                elif msg[0] == 'waiting':
-                    current_players = int(msg[1])
-                    required_players = int(msg[2])
-                    self.players_count_label.config(
-                        text=f"Players: {current_players}/{required_players}"
-                    )
-                
-                elif msg[0] == 'game_start':
-                    self.start_game()
+                data, _ = self.sock.recvfrom(65535)
                 
-                elif msg[0] == 'game_end':
-                    # Parse game end message
-                    end_type = msg[1]
-                    
-                    if end_type == 'ended_by':
-                        ended_by = msg[2]
-                        winners = msg[3].split(';') if msg[3] else []
-                        
-                        # Parse scores
-                        scores = {}
-                        if len(msg) > 4 and msg[4]:
-                            score_pairs = msg[4].split(';')
-                            for pair in score_pairs:
-                                if pair:
-                                    parts = pair.split(',')
-                                    if len(parts) >= 2:
-                                        scores[parts[0]] = int(parts[1])
-                        
-                        self.show_results(winners, scores, ended_by)
-                    else:  # board_full
-                        winners = msg[2].split(';') if msg[2] else []
-                        
-                        # Parse scores
-                        scores = {}
-                        if len(msg) > 3 and msg[3]:
-                            score_pairs = msg[3].split(';')
-                            for pair in score_pairs:
-                                if pair:
-                                    parts = pair.split(',')
-                                    if len(parts) >= 2:
-                                        scores[parts[0]] = int(parts[1])
-                        
-                        self.show_results(winners, scores)
+                if protocol.is_binary(data):
+                    self.binary = True
+                    messages = protocol.decode_all(data, self.players_by_id)
+                else:
+                    # The server may pack several newline-separated messages into one datagram
+                    messages = [line.decode().split(',') for line in data.split(b"\n")]
                 
-                elif msg[0] == 'identity':
-                    self.player_name = msg[1]
-                    self.player_color = msg[2]
-                    
-                    self.player_colors[self.player_name] = self.player_color
-                    self.player_label.config(text=f"You are: {self.player_name}")
-                    self.update_player_legend()
+                sequenced = False
+                for msg in messages:
+                    sequenced = self.receive(msg) or sequenced
                 
-                elif msg[0] == 'player_info':
-                    player_name = msg[1]
-                    player_color = msg[2]
-                    
-                    self.player_colors[player_name] = player_color
-                    self.update_player_legend()
+                if sequenced:
+                    self.send("ack", self.expected_seq - 1, sorted(self.out_of_order)[:MAX_SELECTIVE_ACKS])
                 
-                elif msg[0] == 'board':
-                    board_data = msg[1:]
-                    index = 0
-                    for r in range(self.grid_rows):
-                        for c in range(self.grid_cols):
-                            owner = board_data[index]
-                            color = board_data[index + 1]
-                            
-                            if owner == "None":
-                                self.board_owners[r][c] = None
-                                self.board_colors[r][c] = None
-                            else:
-                                self.board_owners[r][c] = owner
-                                self.board_colors[r][c] = color
-                                
-                                if owner not in self.player_colors and color != "None":
-                                    self.player_colors[owner] = color
-                            
-                            self.update_cell_appearance(r, c)
-                            index += 2
-                    
-                    self.update_player_legend()
+            except Exception as e:
+                print(f"Error: {e}")
+                break
+    
+    def receive(self, msg):
+        """Deliver a server message, putting sequenced ones back in order first.
+        
+        Returns True if the message was sequenced and so needs an ack.
+        """
+        if msg[0] != 'rel':
+            self.post(msg)
+            return False
+        
+        seq = int(msg[1])
+        if seq < self.expected_seq or seq in self.out_of_order:
+            return True     # A retransmit of something we already have
+        
+        if seq > self.expected_seq:
+            self.out_of_order[seq] = msg[2:]
+            
+            # Ask for just the missing range, once; the server's retransmit
+            # timer covers a lost nack
+            if seq - 1 > self.nacked_up_to:
+                self.send("nack", max(self.expected_seq, self.nacked_up_to + 1), seq - 1)
+                self.nacked_up_to = seq - 1
+            return True
+        
+        self.post(msg[2:])
+        self.expected_seq += 1
+        while self.expected_seq in self.out_of_order:
+            self.post(self.out_of_order.pop(self.expected_seq))
+            self.expected_seq += 1
+        return True
+    
+    def handle_message(self, msg):
+        """Apply one server message to the local state and the GUI"""
+        if msg[0] == 'grid_config':
+            # Update grid dimensions
+            self.grid_rows = int(msg[1])
+            self.grid_cols = int(msg[2])
+            
+            # Re-initialize board arrays with new dimensions
+            self.board_owners = [[None for _ in range(self.grid_cols)] for _ in range(self.grid_rows)]
+            self.board_colors = [[None for _ in range(self.grid_cols)] for _ in range(self.grid_rows)]
+            
+            # Initialize the grid UI
+            self.initialize_grid()
+        
+        elif msg[0] == 'waiting':
+            current_players = int(msg[1])
+            required_players = int(msg[2])
+            self.players_count_label.config(
+                text=f"Players: {current_players}/{required_players}"
+            )
+        
+        elif msg[0] == 'game_start':
+            self.start_game()
+        
+        elif msg[0] == 'game_end':
+            # Parse game end message
+            end_type = msg[1]
+            
+            if end_type == 'ended_by':
+                ended_by = msg[2]
+                winners = msg[3].split(';') if msg[3] else []
                 
-                elif msg[0] == 'update':
-                    r, c = int(msg[1]), int(msg[2])
-                    owner = msg[3]
-                    color = msg[4]
-                    
-                    self.board_owners[r][c] = owner
-                    self.board_colors[r][c] = color
-                    
-                    if (r, c) in self.selecting_cells:
-                        if self.selecting_cells[(r, c)]["player"] == self.player_name:
-                            self.is_selecting = False
-                            self.update_status("Selection complete!")
-                        
-                        del self.selecting_cells[(r, c)]
-                        self.checkboxes[r][c]["timer_label"].config(text="")
-                    
-                    self.update_all_cells()
-                    
-                    if owner not in self.player_colors:
-                        self.player_colors[owner] = color
-                        self.update_player_legend()
+                # Parse scores
+                scores = {}
+                if len(msg) > 4 and msg[4]:
+                    score_pairs = msg[4].split(';')
+                    for pair in score_pairs:
+                        if pair:
+                            parts = pair.split(',')
+                            if len(parts) >= 2:
+                                scores[parts[0]] = int(parts[1])
                 
-                elif msg[0] == 'selection_cancelled':
-                    r, c = int(msg[1]), int(msg[2])
-                    
-                    if (r, c) in self.selecting_cells and self.selecting_cells[(r, c)]["player"] == self.player_name:
-                        self.is_selecting = False
-                        self.update_status("Selection cancelled")
-                    
-                    if (r, c) in self.selecting_cells:
-                        del self.selecting_cells[(r, c)]
-                        self.checkboxes[r][c]["timer_label"].config(text="")
-                    
-                    self.update_all_cells()
+                self.show_results(winners, scores, ended_by)
+            else:  # board_full
+                winners = msg[2].split(';') if msg[2] else []
                 
-                elif msg[0] == 'selecting':
-                    r, c = int(msg[1]), int(msg[2])
-                    player = msg[3]
-                    color = msg[4]
-                    duration = float(msg[5])
-                    
-                    self.selecting_cells[(r, c)] = {
-                        "player": player,
-                        "color": color,
-                        "end_time": time.time() + duration
-                    }
-                    
-                    if player == self.player_name:
-                        self.is_selecting = True
-                        self.update_status(f"Selecting cell... {duration:.1f}s")
-                    
-                    self.update_all_cells()
+                # Parse scores
+                scores = {}
+                if len(msg) > 3 and msg[3]:
+                    score_pairs = msg[3].split(';')
+                    for pair in score_pairs:
+                        if pair:
+                            parts = pair.split(',')
+                            if len(parts) >= 2:
+                                scores[parts[0]] = int(parts[1])
                 
-                elif msg[0] == 'block_adjacent':
-                    r, c = int(msg[1]), int(msg[2])
-                    player = msg[3]
-                    color = msg[4]
-                    duration = float(msg[5])
-                    
-                    self.blocked_cells[(r, c)] = {
-                        "player": player,
-                        "color": color,
-                        "end_time": time.time() + duration,
-                        "blink_state": False
-                    }
-                    
-                    for sel_r in range(self.grid_rows):
-                        for sel_c in range(self.grid_cols):
-                            if (sel_r, sel_c) in self.selecting_cells and self.selecting_cells[(sel_r, sel_c)]["player"] == player:
-                                self.blocked_by_selection[(r, c)] = (sel_r, sel_c)
-                                break
-                    
-                    self.update_cell_appearance(r, c)
+                self.show_results(winners, scores)
+        
+        elif msg[0] == 'identity':
+            self.player_name = msg[1]
+            self.player_color = msg[2]
+            
+            self.room_id = int(msg[3]) if len(msg) > 3 else None
+            
+            self.player_colors[self.player_name] = self.player_color
+            room_text = f" (room {self.room_id})" if self.room_id is not None else ""
+            self.player_label.config(text=f"You are: {self.player_name}{room_text}")
+            self.update_player_legend()
+        
+        elif msg[0] == 'player_info':
+            player_name = msg[1]
+            player_color = msg[2]
+            
+            self.player_colors[player_name] = player_color
+            self.update_player_legend()
+        
+        elif msg[0] == 'board_chunk':
+            key = (int(msg[1]), int(msg[2]), int(msg[3]))
+            seq, total = int(msg[4]), int(msg[5])
+            data = msg[6] if isinstance(msg[6], bytes) else base64.b64decode(msg[6])
+            
+            parts = self.snapshot_parts.get(key)
+            if parts is None:
+                if key[0] == snapshot.FULL:
+                    # A newer full snapshot replaces any older one still arriving
+                    self.drop_snapshots(key[1] - 1)
+                parts = self.snapshot_parts[key] = {"total": total, "chunks": {}}
+                self.root.after(SNAPSHOT_RESEND_MS, self.request_missing_chunks, key)
+            parts["chunks"][seq] = data
+            
+            if len(parts["chunks"]) == parts["total"]:
+                del self.snapshot_parts[key]
+                payload = b"".join(parts["chunks"][i] for i in range(parts["total"]))
+                snap = snapshot.decode(payload)
+                self.apply_snapshot(snap)
+                self.drop_snapshots(snap["version"])
+        
+        elif msg[0] == 'update':
+            r, c = int(msg[1]), int(msg[2])
+            owner = msg[3]
+            color = msg[4]
+            
+            if len(msg) > 5:
+                version = int(msg[5])
+                # A skipped version means an update was lost; ask for the delta
+                if self.board_synced and not self.snapshot_parts and version > self.board_version + 1:
+                    self.send("sync", self.board_version)
+                self.board_version = max(self.board_version, version)
+            
+            self.board_owners[r][c] = owner
+            self.board_colors[r][c] = color
+            
+            if (r, c) in self.selecting_cells:
+                if self.selecting_cells[(r, c)]["player"] == self.player_name:
+                    self.is_selecting = False
+                    self.update_status("Selection complete!")
                 
-                elif msg[0] == 'unblock_adjacent':
-                    r, c = int(msg[1]), int(msg[2])
-                    
-                    if (r, c) in self.blocked_cells:
-                        del self.blocked_cells[(r, c)]
-                    
-                    if (r, c) in self.blocked_by_selection:
-                        del self.blocked_by_selection[(r, c)]
-                    
-                    self.update_cell_appearance(r, c)
+                self.remove_selection((r, c))
+            
+            self.update_cell_appearance(r, c, neighbors=True)
+            
+            if owner not in self.player_colors:
+                self.player_colors[owner] = color
+                self.update_player_legend()
+        
+        elif msg[0] == 'selection_cancelled':
+            r, c = int(msg[1]), int(msg[2])
+            
+            if (r, c) in self.selecting_cells and self.selecting_cells[(r, c)]["player"] == self.player_name:
+                self.is_selecting = False
+                self.update_status("Selection cancelled")
+            
+            if (r, c) in self.selecting_cells:
+                self.remove_selection((r, c))
+            
+            self.update_cell_appearance(r, c, neighbors=True)
+        
+        elif msg[0] == 'selecting':
+            r, c = int(msg[1]), int(msg[2])
+            player = msg[3]
+            color = msg[4]
+            duration = float(msg[5])
+            
+            now = time.time()
+            info = self.selecting_cells[(r, c)] = {
+                "player": player,
+                "color": color,
+                "end_time": now + duration
+            }
+            self.selection_of[player] = (r, c)
+            
+            if player == self.player_name:
+                self.is_selecting = True
+                self.update_status(f"Selecting cell... {duration:.1f}s")
+            
+            self.update_cell_appearance(r, c)
+            self.animate_at(self.next_countdown_change(info, now), (r, c), info)
+        
+        elif msg[0] == 'block_adjacent':
+            r, c = int(msg[1]), int(msg[2])
+            player = msg[3]
+            
+            self.block_cell(r, c, player, msg[4], float(msg[5]), self.selection_of.get(player))
+        
+        elif msg[0] == 'block_cells':
+            # The selection (or claimed) cell, then every cell it blocks
+            cell = (int(msg[1]), int(msg[2]))
+            player = msg[3]
+            color = msg[4]
+            duration = float(msg[5])
+            
+            selection = cell if cell in self.selecting_cells else None
+            for i in range(6, len(msg) - 1, 2):
+                self.block_cell(int(msg[i]), int(msg[i + 1]), player, color, duration, selection)
+        
+        elif msg[0] == 'unblock_adjacent':
+            # One or more row,col pairs
+            for i in range(1, len(msg) - 1, 2):
+                r, c = int(msg[i]), int(msg[i + 1])
                 
-                elif msg[0] == 'player_joined':
-                    player = msg[1]
-                    color = msg[2]
-                    
-                    self.player_colors[player] = color
-                    self.update_player_legend()
+                if (r, c) in self.blocked_cells:
+                    del self.blocked_cells[(r, c)]
                 
-                elif msg[0] == 'player_left':
-                    player = msg[1]
-                    
-                    if player in self.player_colors:
-                        del self.player_colors[player]
-                        self.update_player_legend()
+                if (r, c) in self.blocked_by_selection:
+                    del self.blocked_by_selection[(r, c)]
                 
-            except Exception as e:
-                print(f"Error: {e}")
-                break
+                self.update_cell_appearance(r, c)
+        
+        elif msg[0] == 'scores':
+            # Live leaderboard: name,score pairs, highest first
+            self.player_scores = {msg[i]: int(msg[i + 1]) for i in range(1, len(msg) - 1, 2)}
+            self.update_player_legend()
+        
+        elif msg[0] == 'player_joined':
+            player = msg[1]
+            color = msg[2]
+            
+            self.player_colors[player] = color
+            self.update_player_legend()
+        
+        elif msg[0] == 'player_left':
+            player = msg[1]
+            
+            if player in self.player_colors:
+                del self.player_colors[player]
+                self.update_player_legend()
+        
+        elif msg[0] == 'rejected':
+            # Rejected clients never leave the waiting screen, so say why there
+            self.waiting_label.config(text=f"Could not join: {msg[1].replace('_', ' ')}")
+    
+    def remove_selection(self, cell):
+        """Forget a selection that completed, was cancelled or ran out"""
+        info = self.selecting_cells.pop(cell)
+        if self.selection_of.get(info["player"]) == cell:
+            del self.selection_of[info["player"]]
+    
+    def block_cell(self, r, c, player, color, duration, selection=None):
+        """Show a cell as blocked by a player, linked to their selection in progress if any"""
+        now = time.time()
+        info = self.blocked_cells[(r, c)] = {
+            "player": player,
+            "color": color,
+            "end_time": now + duration,
+            "blink_state": False
+        }
+        
+        if selection is not None:
+            self.blocked_by_selection[(r, c)] = selection
+        
+        self.update_cell_appearance(r, c)
+        if self.blink:
+            self.animate_at(now + self.blink_interval / 1000, (r, c), info)
+        else:
+            self.animate_at(info["end_time"] + 0.001, (r, c), info)
+    
+    def request_missing_chunks(self, key):
+        """Ask the server again for snapshot chunks that have not arrived"""
+        parts = self.snapshot_parts.get(key)
+        if parts is None:
+            return
+        
+        missing = [seq for seq in range(parts["total"]) if seq not in parts["chunks"]]
+        self.send("board_resend", key[0], key[1], key[2], missing[:MAX_RESEND_SEQS[self.binary]])
+        self.root.after(SNAPSHOT_RESEND_MS, self.request_missing_chunks, key)
+    
+    def drop_snapshots(self, version):
+        """Stop reassembling snapshots up to a version, once something at least as new is here"""
+        for key in [key for key in self.snapshot_parts if key[1] <= version]:
+            del self.snapshot_parts[key]
+    
+    def apply_snapshot(self, snap):
+        """Apply a full board snapshot or a delta of claimed cells"""
+        palette = snap["palette"]
+        
+        if snap["kind"] == snapshot.FULL:
+            cells = snap["cells"]
+            for r in range(self.grid_rows):
+                for c in range(self.grid_cols):
+                    entry = palette[cells[r * self.grid_cols + c]]
+                    self.set_cell_owner(r, c, entry)
+            self.update_all_cells()
+        else:
+            for r, c, idx in snap["changes"]:
+                self.set_cell_owner(r, c, palette[idx])
+                self.update_cell_appearance(r, c)
+        
+        self.board_version = max(self.board_version, snap["version"])
+        self.board_synced = True
+        self.update_player_legend()
+    
+    def set_cell_owner(self, r, c, entry):
+        if entry is None:
+            self.board_owners[r][c] = None
+            self.board_colors[r][c] = None
+        else:
+            owner, color = entry
+            self.board_owners[r][c] = owner
+            self.board_colors[r][c] = color
+            
+            if owner not in self.player_colors:
+                self.player_colors[owner] = color
     
     def on_closing(self):
         try:
             if not self.game_ended:
-                self.sock.sendto("disconnect".encode(), (SERVER_IP, SERVER_PORT))
+                self.send("disconnect")
         except:
             pass
         self.root.destroy()
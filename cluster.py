@@ -0,0 +1,179 @@
+import os
+import sys
+import signal
+import socket
+import time
+import threading
+import multiprocessing
+
+import protocol
+
+# Forwarded datagrams are prefixed with "host port room_id\n"
+_HEADER_END = b"\n"
+
+
+def _path(run_dir, name):
+    return os.path.join(run_dir, name + ".sock")
+
+
+def _bind_unix(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    if os.path.exists(path):
+        os.unlink(path)
+    sock.bind(path)
+    return sock
+
+
+class Coordinator:
+    """Assigns new players to lobbies across all worker processes.
+
+    Runs in the launcher process on a Unix datagram socket. Each join gets
+    the worker and room id of the current lobby; once REQUIRED_PLAYERS have
+    joined it the next lobby is opened on the next worker, so games are
+    spread over the workers round-robin. Room ids are unique across workers.
+    """
+
+    def __init__(self, run_dir, workers, required_players):
+        self.run_dir = run_dir
+        self.workers = workers
+        self.required_players = required_players
+        self.sock = _bind_unix(_path(run_dir, "coordinator"))
+
+        self.next_room_id = 1
+        self.active = {}            # room id -> worker, for rooms whose game has not ended
+        self.lobby_worker = 0
+        self.lobby_room = None
+        self.lobby_players = 0
+
+    def join(self, current_room=None):
+        # A player registering again while its game is on stays where it is
+        if current_room in self.active:
+            return self.active[current_room], current_room
+
+        if self.lobby_room is None or self.lobby_players >= self.required_players:
+            if self.lobby_room is not None:
+                self.lobby_worker = (self.lobby_worker + 1) % self.workers
+            self.lobby_room = self.next_room_id
+            self.next_room_id += 1
+            self.lobby_players = 0
+            self.active[self.lobby_room] = self.lobby_worker
+        self.lobby_players += 1
+        return self.lobby_worker, self.lobby_room
+
+    def leave(self, room_id):
+        # Only a lobby that has not filled up yet needs its seat back
+        if room_id == self.lobby_room and self.lobby_players > 0:
+            self.lobby_players -= 1
+
+    def serve(self):
+        while True:
+            data, sender = self.sock.recvfrom(256)
+            parts = data.decode().split(',')
+            if parts[0] == 'join':
+                worker, room_id = self.join(int(parts[1]) if len(parts) > 1 else None)
+                self.sock.sendto(f"{worker},{room_id}".encode(), sender)
+            elif parts[0] == 'leave':
+                self.leave(int(parts[1]))
+            elif parts[0] == 'done':
+                self.active.pop(int(parts[1]), None)
+
+
+class Cluster:
+    """A worker's view of the other processes serving the same port.
+
+    The kernel spreads clients over the workers' SO_REUSEPORT sockets by
+    address hash, so each client always reaches the same worker. That
+    worker remembers which worker hosts the client's room and forwards
+    the client's datagrams there over a Unix socket; the owning worker
+    replies to the client directly from its own socket on the shared port.
+    """
+
+    def __init__(self, index, workers, run_dir):
+        self.index = index
+        self.workers = workers
+        self.run_dir = run_dir
+        self.owner_of = {}          # client address -> (worker, room id)
+        self.last_seen = {}         # client address -> time of its last datagram
+        self.inbox = _bind_unix(_path(run_dir, f"worker-{index}"))
+        self.control = _bind_unix(_path(run_dir, f"control-{index}"))
+        self._control_lock = threading.Lock()
+
+    def _request(self, message):
+        with self._control_lock:
+            self.control.sendto(message.encode(), _path(self.run_dir, "coordinator"))
+            return self.control.recv(256).decode()
+
+    def route(self, data, addr):
+        """(worker, room id) that should handle a datagram from addr"""
+        self.last_seen[addr] = time.time()
+        name = protocol.message_name(data)
+        if name == 'register':
+            previous = self.owner_of.get(addr)
+            request = "join" if previous is None else f"join,{previous[1]}"
+            worker, room_id = self._request(request).split(',')
+            self.owner_of[addr] = (int(worker), int(room_id))
+
+            # Registering again moves the client; its old room may live elsewhere
+            if previous is not None and previous[0] != int(worker):
+                self.forward(previous[0], addr, previous[1], b"disconnect")
+        elif name == 'disconnect':
+            self.last_seen.pop(addr, None)
+            return self.owner_of.pop(addr, (self.index, None))
+        return self.owner_of.get(addr, (self.index, None))
+
+    def expire(self, cutoff):
+        """Forget the routes of clients not heard from since cutoff"""
+        for addr, seen in list(self.last_seen.items()):
+            if seen < cutoff:
+                self.last_seen.pop(addr, None)
+                self.owner_of.pop(addr, None)
+
+    def left_lobby(self, room_id):
+        """Give a lobby seat back to the coordinator when a player leaves before the start"""
+        self.control.sendto(f"leave,{room_id}".encode(), _path(self.run_dir, "coordinator"))
+
+    def room_done(self, room_id):
+        """Tell the coordinator a room's game ended or the room closed"""
+        self.control.sendto(f"done,{room_id}".encode(), _path(self.run_dir, "coordinator"))
+
+    def forward(self, worker, addr, room_id, data):
+        header = f"{addr[0]} {addr[1]} {room_id or 0}".encode() + _HEADER_END
+        self.inbox.sendto(header + data, _path(self.run_dir, f"worker-{worker}"))
+
+    def serve_forwarded(self, handler):
+        """Feed datagrams forwarded by other workers to handler(data, addr, room_id)"""
+        while True:
+            packet = self.inbox.recv(65535)
+            header, data = packet.split(_HEADER_END, 1)
+            host, port, room_id = header.decode().split(' ')
+            try:
+                handler(data, (host, int(port)), int(room_id) or None)
+            except Exception as e:
+                print(f"Error: {e}")
+
+
+def launch(processes, worker_main, required_players, run_dir):
+    """Start the coordinator and fork worker_main(cluster) in each worker process"""
+    coordinator = Coordinator(run_dir, processes, required_players)
+
+    context = multiprocessing.get_context("fork")
+    children = []
+    for index in range(processes):
+        child = context.Process(target=_run_worker, args=(worker_main, index, processes, run_dir),
+                                daemon=True)
+        child.start()
+        children.append(child)
+
+    # Turn SIGTERM into a normal exit so the workers are stopped with us
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    print(f"Started {processes} worker processes")
+    try:
+        coordinator.serve()
+    finally:
+        for child in children:
+            child.terminate()
+
+
+def _run_worker(worker_main, index, processes, run_dir):
+    worker_main(Cluster(index, processes, run_dir))
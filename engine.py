@@ -0,0 +1,464 @@
+import contextlib
+import heapq
+import itertools
+import time
+from collections import namedtuple
+
+import snapshot
+from players import PlayerRegistry
+
+SELECTION_DURATION = 3.0
+BLOCK_DURATION = 3.0
+SCORES_INTERVAL = 1.0
+
+COLORS = ["red", "blue", "green", "purple", "orange", "magenta", "cyan", "brown", "yellow", "pink"]
+
+# Per-cell state, row-major. This grid is what click validation reads; the
+# selection and block dicts hold the details (owner, end time) for the cells
+# the grid marks as selecting or blocked, and every change to them goes
+# through refresh_cell_state so the two never disagree.
+FREE, SELECTING, TEMP_BLOCKED, ADJ_BLOCKED, OWNED = range(5)
+
+# A message the engine wants sent. to=None means every player in the game
+# except exclude. The "snapshot" event asks for the board to be sent to one
+# player, however the transport does that.
+Event = namedtuple("Event", "name fields to exclude", defaults=((), None, None))
+
+# Kinds of deadline in the engine's heap
+_COMPLETE, _EXPIRE, _SCORES = range(3)
+
+
+def get_winners(scores):
+    """Get the player(s) with the highest score"""
+    if not scores:
+        return []
+
+    max_score = max(scores.values())
+    winners = [player for player, score in scores.items() if score == max_score]
+    return winners
+
+
+class GameEngine:
+    """The rules of one game, with no sockets, threads or timers.
+
+    register, click, tick, disconnect and end apply an input and return the
+    list of Events it produced. Selections, blocks and the throttled score
+    broadcast end at deadlines kept in a heap; tick(now) processes every
+    deadline up to now, in order, and next_deadline() says when it next has
+    work. Time comes from clock, so simulations can run as fast as the CPU
+    allows. The engine does no locking of its own except for its counters
+    and deadline heap, which are guarded by state_lock when one is given.
+    """
+
+    def __init__(self, rows, cols, required_players, game_id=0, clock=time.time, state_lock=None,
+                 max_players=None):
+        self.rows = rows
+        self.cols = cols
+        self.required_players = required_players
+        self.max_players = max_players
+        self.game_id = game_id
+        self.clock = clock
+        self.state_lock = state_lock if state_lock is not None else contextlib.nullcontext()
+
+        # Each cell holds the owning player's id, or None while free
+        self.board = [[None for _ in range(cols)] for _ in range(rows)]
+        self.cell_state = bytearray(rows * cols)
+
+        self.players = PlayerRegistry(COLORS)
+        self.clients = self.players.by_addr   # Connected players by address
+        self.game_started = False
+        self.game_ended = False
+
+        self.selecting_cells = {}        # cell -> {"addr", "end_time"}
+        self.client_selecting = {}
+        self.adjacent_blocked_cells = {}   # cell -> {"owner", "end_time"}
+        self.temp_blocked_during_selection = {}
+        self.selection_blocks = {}       # selection cell -> cells it temporarily blocked
+
+        # Board version and change history for chunked and delta board syncs
+        self.snapshots = snapshot.SnapshotStore(rows, cols)
+
+        # Running counters kept up to date on every claim
+        self.free_cells = rows * cols
+        self.player_scores = {}          # player id -> cells owned
+        self.scores_due = None           # Deadline of the pending scores event, if any
+
+        # (deadline, tiebreak, kind, cell, addr). Entries are not removed when
+        # a selection is cancelled or a block renewed; tick skips the ones
+        # that no longer match the current state.
+        self._deadlines = []
+        self._counter = itertools.count()
+
+    def _schedule(self, deadline, kind, cell=None, addr=None):
+        with self.state_lock:
+            heapq.heappush(self._deadlines, (deadline, next(self._counter), kind, cell, addr))
+
+    def next_deadline(self):
+        """When tick next has something to do, or None"""
+        with self.state_lock:
+            return self._deadlines[0][0] if self._deadlines else None
+
+    def pending_deadlines(self):
+        """Deadlines queued, including ones that no longer apply"""
+        return len(self._deadlines)
+
+    def get_adjacent_cells(self, row, col):
+        """Get adjacent cells (top, right, bottom, left - not diagonal)"""
+        adjacent = []
+        directions = [(0, 1), (1, 0), (0, -1), (-1, 0)]
+
+        for dr, dc in directions:
+            new_row, new_col = row + dr, col + dc
+            if 0 <= new_row < self.rows and 0 <= new_col < self.cols:
+                adjacent.append((new_row, new_col))
+
+        return adjacent
+
+    def refresh_cell_state(self, row, col):
+        """Recompute a cell's entry in cell_state after its details changed"""
+        cell = (row, col)
+        if self.board[row][col] is not None:
+            state = OWNED
+        elif cell in self.selecting_cells:
+            state = SELECTING
+        elif cell in self.adjacent_blocked_cells:
+            state = ADJ_BLOCKED
+        elif cell in self.temp_blocked_during_selection:
+            state = TEMP_BLOCKED
+        else:
+            state = FREE
+        self.cell_state[row * self.cols + col] = state
+
+    def can_select(self, row, col):
+        """A cell can be selected if it is free and not next to an in-progress selection"""
+        cell_state = self.cell_state
+        if cell_state[row * self.cols + col] != FREE:
+            return False
+
+        for adj_r, adj_c in self.get_adjacent_cells(row, col):
+            if cell_state[adj_r * self.cols + adj_c] == SELECTING:
+                return False
+        return True
+
+    def clear_temp_blocks_for_selection(self, row, col):
+        """Clear temporary blocks associated with a selection"""
+        cells_to_unblock = []
+        for blocked_cell in self.selection_blocks.pop((row, col), ()):
+            # A later selection may have taken this block over
+            info = self.temp_blocked_during_selection.get(blocked_cell)
+            if info is not None and info["selection_cell"] == (row, col):
+                del self.temp_blocked_during_selection[blocked_cell]
+                self.refresh_cell_state(*blocked_cell)
+                cells_to_unblock.append(blocked_cell)
+
+        if cells_to_unblock:
+            return [Event("unblock_adjacent", (cells_to_unblock,))]
+        return []
+
+    def claim_cell(self, row, col, player_id):
+        """Mark a free cell as owned, update the running counters and return the new board version"""
+        self.board[row][col] = player_id
+        self.cell_state[row * self.cols + col] = OWNED
+
+        with self.state_lock:
+            self.free_cells -= 1
+            self.player_scores[player_id] = self.player_scores.get(player_id, 0) + 1
+            return self.snapshots.record(row, col, player_id)
+
+    def is_board_full(self):
+        """Check if the game board is full"""
+        return self.free_cells == 0
+
+    def calculate_scores(self):
+        """Calculate scores for all players"""
+        return dict(self.player_scores)
+
+    def score_list(self):
+        """Current scores as (player, score) pairs, highest first"""
+        ranked = sorted(self.player_scores.items(), key=lambda item: item[1], reverse=True)
+        return [(self.players.by_id[player_id], score) for player_id, score in ranked]
+
+    def register(self, addr, binary=False, reliable=False):
+        """Add a player; returns the player (None if the game is full) and the events that bring everyone up to date"""
+        with self.state_lock:
+            if self.max_players is not None and len(self.clients) >= self.max_players:
+                return None, [Event("rejected", ("room_full",), addr)]
+            player = self.players.add(addr, binary, reliable)
+
+            # Check if we have enough players to start
+            starting = len(self.clients) >= self.required_players and not self.game_started
+            if starting:
+                self.game_started = True
+
+        events = [
+            Event("grid_config", (self.rows, self.cols), addr),
+            Event("identity", (player, self.game_id), addr),
+            Event("waiting", (len(self.clients), self.required_players)),
+        ]
+
+        if starting:
+            events.append(Event("game_start"))
+        elif self.game_started:
+            events.append(Event("game_start", (), addr))
+
+        events += self._catch_up(addr)
+        events.append(Event("player_joined", (player,), exclude=addr))
+        return player, events
+
+    def rejoin(self, addr, binary=False, reliable=False):
+        """Welcome a connected player again, e.g. after its register replies were lost"""
+        player = self.clients.get(addr)
+        if player is None:
+            return []
+        player["binary"] = binary
+        player["reliable"] = reliable
+
+        events = [
+            Event("grid_config", (self.rows, self.cols), addr),
+            Event("identity", (player, self.game_id), addr),
+            Event("waiting", (len(self.clients), self.required_players), addr),
+        ]
+        if self.game_started:
+            events.append(Event("game_start", (), addr))
+        return events + self._catch_up(addr)
+
+    def _catch_up(self, addr):
+        """Events that tell an arriving player about everyone, the board and what is in progress"""
+        events = []
+        for client_data in list(self.clients.values()):
+            events.append(Event("player_info", (client_data,), addr))
+
+        events.append(Event("snapshot", (), addr))
+
+        now = self.clock()
+        for (r, c), selection_info in self.selecting_cells.items():
+            sel_player = self.clients.get(selection_info["addr"])
+            if sel_player is None:
+                continue
+            remain_time = max(0, selection_info["end_time"] - now)
+            events.append(Event("selecting", (r, c, sel_player, remain_time), addr))
+
+            blocked = [cell for cell in self.selection_blocks.get((r, c), ())
+                       if self.temp_blocked_during_selection.get(cell, {}).get("selection_cell") == (r, c)]
+            if blocked:
+                events.append(Event("block_cells", (r, c, sel_player, remain_time, blocked), addr))
+
+        for (r, c), block_info in self.adjacent_blocked_cells.items():
+            remain_time = max(0, block_info["end_time"] - now)
+            events.append(Event("block_adjacent", (r, c, block_info["owner"], remain_time), addr))
+        return events
+
+    def restore_player(self, player_id, color, addr, binary=False):
+        """Add a player from a saved game, starting the game as register would"""
+        with self.state_lock:
+            player = self.players.restore(player_id, color, addr, binary)
+            if len(self.clients) >= self.required_players:
+                self.game_started = True
+        return player
+
+    def restore_board(self, board, version):
+        """Load a saved board of player ids (None for free cells) at a board version"""
+        self.board = board
+        self.free_cells = self.rows * self.cols
+        self.player_scores = {}
+        for row in range(self.rows):
+            for col in range(self.cols):
+                owner = board[row][col]
+                if owner is not None:
+                    self.cell_state[row * self.cols + col] = OWNED
+                    self.free_cells -= 1
+                    self.player_scores[owner] = self.player_scores.get(owner, 0) + 1
+        self.snapshots.version = version
+
+    def click(self, addr, row, col):
+        """Start a selection for a player, if the cell can be selected"""
+        if self.game_ended or addr not in self.clients:
+            return []
+
+        if not (0 <= row < self.rows and 0 <= col < self.cols):
+            return []
+
+        # setdefault is atomic, so a player clicking twice at once (possibly
+        # in two different tiles) only gets one selection
+        cell = (row, col)
+        if self.client_selecting.setdefault(addr, cell) is not cell:
+            return []
+
+        if not self.can_select(row, col):
+            del self.client_selecting[addr]
+            return []
+
+        player = self.clients[addr]
+        end_time = self.clock() + SELECTION_DURATION
+
+        self.selecting_cells[cell] = {"addr": addr, "end_time": end_time}
+        self.refresh_cell_state(row, col)
+        self._schedule(end_time, _COMPLETE, cell, addr)
+
+        events = [Event("selecting", (row, col, player, SELECTION_DURATION))]
+        blocked = self.selection_blocks[cell] = []
+        for adj_r, adj_c in self.get_adjacent_cells(row, col):
+            if self.cell_state[adj_r * self.cols + adj_c] in (FREE, TEMP_BLOCKED):
+                self.temp_blocked_during_selection[(adj_r, adj_c)] = {"selection_cell": cell}
+                blocked.append((adj_r, adj_c))
+                self.refresh_cell_state(adj_r, adj_c)
+
+        # One message for all the cells, naming the selection that blocks them
+        if blocked:
+            events.append(Event("block_cells", (row, col, player, SELECTION_DURATION, list(blocked))))
+        return events
+
+    def complete_selection(self, row, col, client_addr, now=None):
+        """Claim a selected cell for its player and block the cells around it"""
+        info = self.selecting_cells.get((row, col))
+        if info is None or info["addr"] != client_addr:
+            return []
+
+        if self.game_ended or client_addr not in self.clients:
+            return self.cancel_selection(row, col)
+
+        if now is None:
+            now = self.clock()
+
+        player = self.clients[client_addr]
+        version = self.claim_cell(row, col, player["id"])     # Marking the cell occupied by the client
+
+        del self.selecting_cells[(row, col)]
+        self.refresh_cell_state(row, col)
+
+        if self.client_selecting.get(client_addr) == (row, col):
+            del self.client_selecting[client_addr]
+
+        events = [Event("update", (row, col, player, version))]
+        events += self.clear_temp_blocks_for_selection(row, col)
+
+        end_time = now + BLOCK_DURATION
+        blocked = []
+        for adj_r, adj_c in self.get_adjacent_cells(row, col):
+            if self.cell_state[adj_r * self.cols + adj_c] != OWNED:
+                self.adjacent_blocked_cells[(adj_r, adj_c)] = {"owner": player, "end_time": end_time}
+                self.refresh_cell_state(adj_r, adj_c)
+                self._schedule(end_time, _EXPIRE, (adj_r, adj_c))
+                blocked.append((adj_r, adj_c))
+
+        if blocked:
+            events.append(Event("block_cells", (row, col, player, BLOCK_DURATION, blocked)))
+
+        # Check if board is full after this selection
+        if self.is_board_full():
+            events += self.end()
+        else:
+            with self.state_lock:
+                schedule_scores = self.scores_due is None
+                if schedule_scores:
+                    self.scores_due = now + SCORES_INTERVAL
+            if schedule_scores:
+                self._schedule(self.scores_due, _SCORES)
+        return events
+
+    def cancel_selection(self, row, col):
+        """Cancel an in-progress selection and release its temporary blocks"""
+        info = self.selecting_cells.pop((row, col), None)
+        if info is None:
+            return []
+        self.refresh_cell_state(row, col)
+
+        client_addr = info["addr"]
+        if self.client_selecting.get(client_addr) == (row, col):
+            del self.client_selecting[client_addr]
+
+        return [Event("selection_cancelled", (row, col))] + self.clear_temp_blocks_for_selection(row, col)
+
+    def expire_block(self, row, col, now=None):
+        """Release an adjacent block once its end time has passed"""
+        info = self.adjacent_blocked_cells.get((row, col))
+        if info is None or (now if now is not None else self.clock()) < info["end_time"]:
+            return []
+
+        del self.adjacent_blocked_cells[(row, col)]
+        self.refresh_cell_state(row, col)
+        return [Event("unblock_adjacent", ([(row, col)],))]
+
+    def tick(self, now=None):
+        """Process every deadline up to now, earliest first"""
+        if now is None:
+            now = self.clock()
+
+        events = []
+        while True:
+            with self.state_lock:
+                if not self._deadlines or self._deadlines[0][0] > now:
+                    break
+                deadline, _, kind, cell, addr = heapq.heappop(self._deadlines)
+
+            if kind == _COMPLETE:
+                info = self.selecting_cells.get(cell)
+                if info is not None and info["addr"] == addr and info["end_time"] == deadline:
+                    events += self.complete_selection(cell[0], cell[1], addr, now=deadline)
+            elif kind == _EXPIRE:
+                info = self.adjacent_blocked_cells.get(cell)
+                if info is not None and info["end_time"] == deadline:
+                    events += self.expire_block(cell[0], cell[1], now=deadline)
+            else:
+                with self.state_lock:
+                    self.scores_due = None
+                    scores = self.score_list()
+                events.append(Event("scores", (scores,)))
+        return events
+
+    def end(self, ended_by=None):
+        """End the game and announce the results"""
+        with self.state_lock:
+            if self.game_ended:
+                return []
+
+            self.game_ended = True
+
+            # Calculate final scores
+            scores = {self.players.name(player_id): score
+                      for player_id, score in self.calculate_scores().items()}
+        winners = get_winners(scores)
+
+        # Construct end game message
+        end_type = "ended_by" if ended_by else "board_full"
+        return [Event("game_end", (end_type, ended_by, winners, list(scores.items())))]
+
+    def request_end(self, addr):
+        """A player asked to end the game early"""
+        if addr in self.clients and self.game_started and not self.game_ended:
+            return self.end(self.clients[addr]["name"])
+        return []
+
+    def disconnect(self, addr):
+        """Remove a player, cancelling their selection in progress"""
+        player = self.clients.get(addr)
+        if player is None:
+            return []
+
+        events = []
+        cell = self.client_selecting.get(addr)
+        if cell is not None:
+            info = self.selecting_cells.get(cell)
+            if info is not None and info["addr"] == addr:
+                events += self.cancel_selection(*cell)
+            self.client_selecting.pop(addr, None)
+
+        with self.state_lock:
+            self.players.remove(addr)
+
+        events.append(Event("player_left", (player,)))
+
+        # Update waiting status if game hasn't started
+        if not self.game_started:
+            events.append(Event("waiting", (len(self.clients), self.required_players)))
+        return events
+
+    def close(self):
+        """End the game without announcing it and drop everything pending"""
+        with self.state_lock:
+            self.game_ended = True
+            self._deadlines.clear()
+            self.scores_due = None
+        self.selecting_cells.clear()
+        self.adjacent_blocked_cells.clear()
+        self.client_selecting.clear()
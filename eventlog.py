@@ -0,0 +1,301 @@
+"""Append-only event log of every game, for crash recovery and replay.
+
+The log is a directory of numbered segment files. Each segment starts with
+a checkpoint (a compact snapshot of every open room, closed by a
+CHECKPOINT_END record), followed by the joins, leaves, claims, game ends and
+room opens and closes that happened after it. Records are length-prefixed
+and checksummed, so a record torn by a crash is simply where replay stops.
+
+Writers only queue records; a background thread writes and fsyncs whatever
+has queued every commit interval (group commit), so no game path ever
+waits on the disk.
+"""
+import array
+import glob
+import os
+import struct
+import threading
+import time
+import zlib
+
+from engine import GameEngine
+
+OPEN, JOIN, LEAVE, CLAIM, END, CLOSE, SNAPSHOT, CHECKPOINT_END = range(1, 9)
+
+COMMIT_INTERVAL = 0.05      # Seconds between group commits
+KEEP_SEGMENTS = 10          # Older segments are deleted when a new one starts
+
+_FRAME = struct.Struct(">II")       # body length, crc32 of body
+_HEADER = struct.Struct(">BId")     # record type, room id, time
+_OPEN = struct.Struct(">HHH")       # rows, cols, required players
+_CLAIM = struct.Struct(">HHHI")     # row, col, player id, board version
+_ROOM_STATE = struct.Struct(">HHHBBII")   # rows, cols, required, started, ended, version, next id
+_PLAYER = struct.Struct(">HB")      # player id, binary
+
+
+def _pack_str(value):
+    data = value.encode()
+    return struct.pack(">H", len(data)) + data
+
+
+def _read_str(data, offset):
+    length, = struct.unpack_from(">H", data, offset)
+    offset += 2
+    return data[offset:offset + length].decode(), offset + length
+
+
+def _pack_addr(addr):
+    if addr is None:
+        return _pack_str("") + struct.pack(">H", 0)
+    return _pack_str(addr[0]) + struct.pack(">H", addr[1])
+
+
+def _read_addr(data, offset):
+    host, offset = _read_str(data, offset)
+    port, = struct.unpack_from(">H", data, offset)
+    return ((host, port) if host else None), offset + 2
+
+
+def encode_snapshot(engine):
+    """The state of a game that outlives a restart: board, players and flags"""
+    body = [_ROOM_STATE.pack(engine.rows, engine.cols, engine.required_players,
+                             engine.game_started, engine.game_ended,
+                             engine.snapshots.version, engine.players.next_id)]
+
+    players = sorted(engine.players.by_id.values(), key=lambda player: player["id"])
+    body.append(struct.pack(">H", len(players)))
+    for player in players:
+        connected = engine.players.get(player["addr"]) is player
+        body.append(_PLAYER.pack(player["id"], player["binary"]))
+        body.append(_pack_str(player["color"]))
+        body.append(_pack_addr(player["addr"] if connected else None))
+
+    owners = array.array("H", (owner or 0 for line in engine.board for owner in line))
+    owners.byteswap()   # Big-endian like the rest of the log
+    body.append(zlib.compress(owners.tobytes()))
+    return b"".join(body)
+
+
+def decode_snapshot(data, make_engine, room_id):
+    rows, cols, required, started, ended, version, next_id = _ROOM_STATE.unpack_from(data, 0)
+    engine = make_engine(room_id, rows, cols, required)
+    offset = _ROOM_STATE.size
+
+    count, = struct.unpack_from(">H", data, offset)
+    offset += 2
+    for _ in range(count):
+        player_id, binary = _PLAYER.unpack_from(data, offset)
+        color, offset = _read_str(data, offset + _PLAYER.size)
+        addr, offset = _read_addr(data, offset)
+        engine.restore_player(player_id, color, addr, bool(binary))
+    engine.players.next_id = max(engine.players.next_id, next_id)
+
+    owners = array.array("H", zlib.decompress(data[offset:]))
+    owners.byteswap()
+    board = [[owners[row * cols + col] or None for col in range(cols)] for row in range(rows)]
+    engine.restore_board(board, version)
+    engine.game_started = bool(started)
+    engine.game_ended = bool(ended)
+    return engine
+
+
+def read_records(path):
+    """(type, room id, time, payload) for each intact record of a segment"""
+    with open(path, "rb") as f:
+        data = f.read()
+
+    offset = 0
+    while offset + _FRAME.size <= len(data):
+        length, crc = _FRAME.unpack_from(data, offset)
+        body = data[offset + _FRAME.size:offset + _FRAME.size + length]
+        if len(body) < length or zlib.crc32(body) != crc:
+            return      # Torn or damaged: nothing after it can be trusted
+        kind, room_id, timestamp = _HEADER.unpack_from(body, 0)
+        yield kind, room_id, timestamp, body[_HEADER.size:]
+        offset += _FRAME.size + length
+
+
+def segments(directory):
+    return sorted(glob.glob(os.path.join(directory, "events-*.log")))
+
+
+def _checkpoint_time(path):
+    """When the checkpoint at the start of a segment completed, or None if it never did"""
+    for kind, _, timestamp, _ in read_records(path):
+        if kind == CHECKPOINT_END:
+            return timestamp
+    return None
+
+
+def default_engine(room_id, rows, cols, required_players):
+    return GameEngine(rows, cols, required_players, game_id=room_id)
+
+
+def replay(directory, until=None, make_engine=default_engine):
+    """Rebuild every open game from the log, optionally as it was at time until.
+
+    Starts from the latest complete checkpoint (at or before until) and
+    applies the records after it. make_engine(room_id, rows, cols,
+    required_players) creates the engine for each room. Returns room id ->
+    engine for the rooms that were open.
+    """
+    paths = segments(directory)
+    start = None
+    for index in range(len(paths) - 1, -1, -1):
+        done = _checkpoint_time(paths[index])
+        if done is not None and (until is None or done <= until):
+            start = index
+            break
+    if start is None:
+        return {}
+
+    engines = {}
+    for path in paths[start:]:
+        for kind, room_id, timestamp, payload in read_records(path):
+            if until is not None and timestamp > until:
+                return engines
+            apply(engines, kind, room_id, payload, make_engine)
+    return engines
+
+
+def apply(engines, kind, room_id, payload, make_engine=default_engine):
+    """Apply one record to the games being rebuilt"""
+    if kind == OPEN:
+        engines[room_id] = make_engine(room_id, *_OPEN.unpack_from(payload, 0))
+        return
+    if kind == SNAPSHOT:
+        # Records for the room that were queued before the snapshot are
+        # already part of it
+        engines[room_id] = decode_snapshot(payload, make_engine, room_id)
+        return
+
+    engine = engines.get(room_id)
+    if engine is None:
+        return
+
+    if kind == JOIN:
+        player_id, binary = _PLAYER.unpack_from(payload, 0)
+        color, offset = _read_str(payload, _PLAYER.size)
+        addr, _ = _read_addr(payload, offset)
+        engine.restore_player(player_id, color, addr, bool(binary))
+    elif kind == LEAVE:
+        addr, _ = _read_addr(payload, 0)
+        engine.disconnect(addr)
+    elif kind == CLAIM:
+        row, col, player_id, version = _CLAIM.unpack_from(payload, 0)
+        engine.claim_cell(row, col, player_id)
+    elif kind == END:
+        ended_by, _ = _read_str(payload, 0)
+        engine.end(ended_by or None)
+    elif kind == CLOSE:
+        del engines[room_id]
+
+
+class EventLog:
+    """Queues log records and group-commits them from a writer thread"""
+
+    def __init__(self, directory, commit_interval=COMMIT_INTERVAL, keep=KEEP_SEGMENTS):
+        self.directory = directory
+        self.commit_interval = commit_interval
+        self.keep = keep
+        os.makedirs(directory, exist_ok=True)
+
+        existing = segments(directory)
+        self.next_segment = int(os.path.basename(existing[-1])[7:-4]) + 1 if existing else 1
+
+        self._pending = []
+        self._cond = threading.Condition()
+        self._running = True
+        self._file = None
+
+        self.records = 0
+        self.commits = 0
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def append(self, kind, room_id, payload=b""):
+        body = _HEADER.pack(kind, room_id, time.time()) + payload
+        frame = _FRAME.pack(len(body), zlib.crc32(body)) + body
+        with self._cond:
+            self._pending.append(frame)
+
+    def open_room(self, room_id, rows, cols, required_players):
+        self.append(OPEN, room_id, _OPEN.pack(rows, cols, required_players))
+
+    def join(self, room_id, player):
+        self.append(JOIN, room_id, _PLAYER.pack(player["id"], player["binary"]) +
+                    _pack_str(player["color"]) + _pack_addr(player["addr"]))
+
+    def leave(self, room_id, addr):
+        self.append(LEAVE, room_id, _pack_addr(addr))
+
+    def claim(self, room_id, row, col, player_id, version):
+        self.append(CLAIM, room_id, _CLAIM.pack(row, col, player_id, version))
+
+    def end(self, room_id, ended_by):
+        self.append(END, room_id, _pack_str(ended_by or ""))
+
+    def close_room(self, room_id):
+        self.append(CLOSE, room_id)
+
+    def start_checkpoint(self):
+        """Start a new segment; snapshot every open room next, then call end_checkpoint"""
+        path = os.path.join(self.directory, f"events-{self.next_segment:06d}.log")
+        self.next_segment += 1
+        with self._cond:
+            # Queued in order, so records appended before this stay in the old segment
+            self._pending.append(path)
+            self._cond.notify()
+
+    def snapshot(self, room_id, engine):
+        self.append(SNAPSHOT, room_id, encode_snapshot(engine))
+
+    def end_checkpoint(self):
+        self.append(CHECKPOINT_END, 0)
+
+    def close(self):
+        """Commit everything queued and stop the writer"""
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._running:
+                    self._cond.wait(self.commit_interval)
+                batch, self._pending = self._pending, []
+                running = self._running
+
+            self._commit(batch)
+            if not running:
+                if self._file is not None:
+                    self._file.close()
+                return
+
+    def _commit(self, batch):
+        if not batch:
+            return
+        for item in batch:
+            if isinstance(item, str):
+                self._sync()
+                if self._file is not None:
+                    self._file.close()
+                self._file = open(item, "ab")
+                self._prune()
+            elif self._file is not None:
+                self._file.write(item)
+                self.records += 1
+        self._sync()
+
+    def _sync(self):
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.commits += 1
+
+    def _prune(self):
+        for path in segments(self.directory)[:-self.keep]:
+            os.remove(path)
@@ -0,0 +1,328 @@
+"""Headless bot clients and a load generator for capacity testing.
+
+Each bot speaks the same protocol as client.py: it registers, follows the
+board from update messages, clicks a random free cell whenever it is not
+already selecting one, acks sequenced messages and sends heartbeats. When
+its game ends it registers again and joins the next room. All bots run on
+one asyncio event loop, one UDP socket each; the open file limit is
+raised to fit them where the hard limit allows. Example:
+
+    python loadgen.py --bots 2000 --clicks-per-second 0.5 --duration 30
+
+With --spawn the generator also starts Server.py with the given grid size
+and stops it at the end. The report gives click-to-selecting latency (how
+long the server takes to answer a click), click-to-update latency (which
+includes the selection time), datagram rates and the share of sequenced
+messages that were lost in transit and had to be resent.
+"""
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import time
+
+try:
+    import resource
+except ImportError:     # Windows has no file descriptor limit to raise
+    resource = None
+
+import protocol
+
+HEARTBEAT_INTERVAL = 2.0
+
+# A click the server has not answered with "selecting" by then was rejected
+CLICK_TIMEOUT = 1.0
+
+# Open files needed besides the bots' sockets (event loop, stdio, the server pipe)
+SPARE_FILES = 32
+
+
+class Stats:
+    def __init__(self):
+        self.sent = 0
+        self.received = 0
+        self.clicks = 0
+        self.selections = 0
+        self.claims = 0
+        self.games = 0
+        self.select_latency = []
+        self.update_latency = []
+        self.sequenced = 0
+        self.gaps = 0
+        self.rejections = 0
+
+
+class Bot(asyncio.DatagramProtocol):
+    """One headless player"""
+
+    def __init__(self, server, stats, click_rate, binary, reliable, rng):
+        self.server = server
+        self.stats = stats
+        self.click_rate = click_rate
+        self.binary = binary
+        self.reliable = reliable
+        self.rng = rng
+        self.transport = None
+        self.reset()
+
+    def reset(self):
+        self.name = None
+        self.rows = self.cols = 0
+        self.taken = set()
+        self.started = False
+        self.ended = False
+        self.players = {}
+        self.click = None           # (row, col, sent at) of the click in flight
+        self.selecting = False
+        self.expected_seq = 1
+        self.highest_seq = 0
+        self.out_of_order = {}
+        # Messages from the previous room may still be in flight after a new
+        # register; the new sequence always starts over at 1
+        self.awaiting_first = True
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.register()
+
+    def send(self, name, *fields):
+        self.transport.sendto(protocol.encode(name, fields, self.binary))
+        self.stats.sent += 1
+
+    def register(self):
+        tags = [protocol.BINARY_TAG] if self.binary else []
+        if self.reliable:
+            tags.append(protocol.RELIABLE_TAG)
+        self.reset()
+        self.transport.sendto(",".join(["register"] + tags).encode())
+        self.stats.sent += 1
+
+    def datagram_received(self, data, addr):
+        self.stats.received += 1
+        if protocol.is_binary(data):
+            messages = protocol.decode_all(data, self.players)
+        else:
+            messages = [line.decode().split(',') for line in data.split(b"\n")]
+
+        sequenced = False
+        for msg in messages:
+            if msg[0] == 'rel':
+                sequenced = True
+                self.receive_sequenced(int(msg[1]), msg[2:])
+            else:
+                self.handle_message(msg)
+
+        if sequenced:
+            self.send("ack", self.expected_seq - 1, sorted(self.out_of_order)[:32])
+
+    def receive_sequenced(self, seq, msg):
+        """Deliver sequenced messages in order, counting gaps as losses"""
+        if self.awaiting_first:
+            if seq != 1:
+                return
+            self.awaiting_first = False
+        if seq < self.expected_seq or seq in self.out_of_order:
+            return
+        if seq > self.highest_seq:
+            # Numbers skipped on first arrival were lost (or reordered) on the way
+            if seq > self.highest_seq + 1:
+                self.stats.gaps += seq - self.highest_seq - 1
+                self.send("nack", self.highest_seq + 1, seq - 1)
+            self.highest_seq = seq
+            self.stats.sequenced += 1
+
+        if seq > self.expected_seq:
+            self.out_of_order[seq] = msg
+            return
+
+        self.handle_message(msg)
+        self.expected_seq += 1
+        while self.expected_seq in self.out_of_order:
+            self.handle_message(self.out_of_order.pop(self.expected_seq))
+            self.expected_seq += 1
+
+    def handle_message(self, msg):
+        kind = msg[0]
+        if kind == 'grid_config':
+            self.rows, self.cols = int(msg[1]), int(msg[2])
+        elif kind == 'identity':
+            self.name = msg[1]
+        elif kind == 'game_start':
+            self.started = True
+        elif kind == 'selecting':
+            row, col = int(msg[1]), int(msg[2])
+            if self.click is not None and msg[3] == self.name and (row, col) == self.click[:2]:
+                self.stats.select_latency.append(time.perf_counter() - self.click[2])
+                self.stats.selections += 1
+                self.selecting = True
+        elif kind == 'update':
+            row, col = int(msg[1]), int(msg[2])
+            self.taken.add((row, col))
+            if self.click is not None and msg[3] == self.name and (row, col) == self.click[:2]:
+                self.stats.update_latency.append(time.perf_counter() - self.click[2])
+                self.stats.claims += 1
+                self.click = None
+                self.selecting = False
+        elif kind == 'selection_cancelled':
+            if self.click is not None and (int(msg[1]), int(msg[2])) == self.click[:2]:
+                self.click = None
+                self.selecting = False
+        elif kind == 'game_end':
+            self.ended = True
+            self.stats.games += 1
+        elif kind == 'rejected':
+            # Try again at the next click
+            self.ended = True
+            self.stats.rejections += 1
+
+    def maybe_click(self, now):
+        if not self.started or self.ended or self.rows == 0:
+            return
+        if self.click is not None:
+            if self.selecting or now - self.click[2] < CLICK_TIMEOUT:
+                return
+            self.click = None       # Rejected: the cell was not free
+
+        if len(self.taken) >= self.rows * self.cols:
+            return
+        while True:
+            cell = (self.rng.randrange(self.rows), self.rng.randrange(self.cols))
+            if cell not in self.taken:
+                break
+        self.click = (cell[0], cell[1], now)
+        self.send("click", cell[0], cell[1])
+        self.stats.clicks += 1
+
+    async def run(self, stop):
+        now = time.perf_counter()
+        next_click = now + self.rng.expovariate(self.click_rate)
+        next_heartbeat = now + HEARTBEAT_INTERVAL
+        while not stop.is_set():
+            await asyncio.sleep(max(0.0, min(next_click, next_heartbeat) - time.perf_counter()))
+            now = time.perf_counter()
+
+            if now >= next_heartbeat:
+                self.send("heartbeat")
+                next_heartbeat = now + HEARTBEAT_INTERVAL
+
+            if now >= next_click:
+                next_click = now + self.rng.expovariate(self.click_rate)
+                if self.ended:
+                    self.register()
+                else:
+                    self.maybe_click(now)
+
+
+def percentiles(samples, points=(50, 90, 99)):
+    """Selected percentiles of samples in milliseconds, plus the maximum"""
+    if not samples:
+        return "no samples"
+    ordered = sorted(samples)
+    parts = [f"p{p} {ordered[min(len(ordered) - 1, len(ordered) * p // 100)] * 1000:.1f}" for p in points]
+    parts.append(f"max {ordered[-1] * 1000:.1f}")
+    return " ".join(parts) + " ms"
+
+
+def raise_file_limit(bots):
+    """Raise the soft open file limit to fit a socket per bot; False if the hard limit is too low"""
+    if resource is None:
+        return True
+    needed = bots + SPARE_FILES
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY or soft >= needed:
+        return True
+    try:
+        if hard != resource.RLIM_INFINITY and hard < needed:
+            raise ValueError(f"hard limit is {hard}")
+        resource.setrlimit(resource.RLIMIT_NOFILE, (needed, hard))
+    except (ValueError, OSError) as e:
+        print(f"{bots} bots need {needed} open files but the limit is {soft} ({e}); "
+              f"raise it with ulimit -n or run fewer bots")
+        return False
+    return True
+
+
+async def generate(args):
+    loop = asyncio.get_running_loop()
+    stats = Stats()
+    stop = asyncio.Event()
+    rng = random.Random(args.seed)
+
+    bots = []
+    for i in range(args.bots):
+        bot = Bot((args.host, args.port), stats, args.clicks_per_second,
+                  binary=not args.text, reliable=not args.unreliable, rng=random.Random(rng.random()))
+        await loop.create_datagram_endpoint(lambda bot=bot: bot, remote_addr=(args.host, args.port))
+        bots.append(bot)
+        # Stagger registrations so the server sees a ramp, not a burst
+        if args.ramp > 0:
+            await asyncio.sleep(args.ramp / args.bots)
+
+    start = time.perf_counter()
+    sent_before, received_before = stats.sent, stats.received
+    tasks = [asyncio.create_task(bot.run(stop)) for bot in bots]
+    await asyncio.sleep(args.duration)
+    stop.set()
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+
+    for bot in bots:
+        if bot.transport is not None:
+            bot.send("disconnect")
+            bot.transport.close()
+
+    sent = stats.sent - sent_before
+    received = stats.received - received_before
+    print(f"{args.bots} bots for {elapsed:.1f}s, {stats.games} games finished")
+    print(f"clicks {stats.clicks}, selections {stats.selections}, claims {stats.claims}")
+    if stats.rejections:
+        print(f"registrations rejected: {stats.rejections}")
+    print(f"click -> selecting: {percentiles(stats.select_latency)}")
+    print(f"click -> update:    {percentiles(stats.update_latency)}")
+    print(f"datagrams/s: {sent / elapsed:.0f} sent, {received / elapsed:.0f} received")
+    if stats.sequenced:
+        lost = stats.gaps / stats.sequenced * 100
+        print(f"sequenced messages: {stats.sequenced}, lost in transit {lost:.2f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5005)
+    parser.add_argument("--bots", type=int, default=300)
+    parser.add_argument("--clicks-per-second", type=float, default=1.0, help="average click attempts per bot")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds to run after all bots joined")
+    parser.add_argument("--ramp", type=float, default=2.0, help="seconds over which bots join")
+    parser.add_argument("--text", action="store_true", help="use the text protocol instead of binary")
+    parser.add_argument("--unreliable", action="store_true", help="do not ask for sequenced delivery")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--spawn", action="store_true", help="start Server.py for the run")
+    parser.add_argument("--rows", type=int, default=10, help="grid rows of the spawned server")
+    parser.add_argument("--cols", type=int, default=10, help="grid columns of the spawned server")
+    parser.add_argument("--server-arg", action="append", default=[],
+                        help="extra argument for the spawned server, e.g. --server-arg=--engine=asyncio")
+    args = parser.parse_args()
+
+    if not raise_file_limit(args.bots):
+        sys.exit(1)
+
+    server = None
+    if args.spawn:
+        server = subprocess.Popen([sys.executable, "Server.py", "--rows", str(args.rows),
+                                   "--cols", str(args.cols)] + args.server_arg,
+                                  cwd=os.path.dirname(os.path.abspath(__file__)),
+                                  stdout=subprocess.DEVNULL)
+        time.sleep(1.0)
+
+    try:
+        asyncio.run(generate(args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
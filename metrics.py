@@ -0,0 +1,156 @@
+import bisect
+import threading
+from time import perf_counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+# Every metric created in this process, in creation order
+_registry = []
+
+# Updates take no lock so they stay cheap on hot paths. Under the GIL an
+# update is only lost if a thread switch lands in the middle of one, which
+# is rare enough not to matter for monitoring.
+
+
+class Counter:
+    """A count per label, e.g. messages received per message type"""
+
+    def __init__(self, name, help, label=None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.values = {}
+        _registry.append(self)
+
+    def inc(self, label_value=None, amount=1):
+        values = self.values
+        values[label_value] = values.get(label_value, 0) + amount
+
+    def render(self):
+        values = sorted(list(self.values.items()), key=lambda item: str(item[0]))
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for label_value, value in values:
+            lines.append(f"{self.name}{_labels(self.label, label_value)} {value}")
+        return lines
+
+
+class Histogram:
+    """Observations counted into fixed buckets, with their sum"""
+
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.bounds = sorted(buckets)
+        self.counts = [0] * (len(self.bounds) + 1)     # Last slot is +Inf
+        self.sum = 0.0
+        _registry.append(self)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def render(self):
+        counts = list(self.counts)
+        total_sum = self.sum
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        cumulative = 0
+        for bound, count in zip([f"{bound:g}" for bound in self.bounds] + ["+Inf"], counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f"{self.name}_sum {total_sum:.6f}")
+        lines.append(f"{self.name}_count {cumulative}")
+        return lines
+
+
+class Gauge:
+    """A value read when metrics are rendered, so it costs nothing in between.
+
+    read returns a number, or a dict of label value -> number. kind="counter"
+    exposes a running total some other object already keeps.
+    """
+
+    def __init__(self, name, help, read, label=None, kind="gauge"):
+        self.name = name
+        self.help = help
+        self.read = read
+        self.label = label
+        self.kind = kind
+        _registry.append(self)
+
+    def render(self):
+        value = self.read()
+        values = value.items() if isinstance(value, dict) else [(None, value)]
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for label_value, number in values:
+            lines.append(f"{self.name}{_labels(self.label, label_value)} {number}")
+        return lines
+
+
+def _labels(label, value):
+    if label is None or value is None:
+        return ""
+    return f'{{{label}="{value}"}}'
+
+
+class TimedLock:
+    """Wraps a lock to record how long callers wait for it and hold it"""
+
+    def __init__(self, lock, wait, hold):
+        self.lock = lock
+        self.wait = wait
+        self.hold = hold
+        self._acquired = 0.0
+        self._waited = 0.0
+
+    def __enter__(self):
+        # Uncontended acquires, the common case, skip timing the wait
+        if self.lock.acquire(False):
+            self._acquired = perf_counter()
+            self._waited = 0.0
+        else:
+            start = perf_counter()
+            self.lock.acquire()
+            self._acquired = perf_counter()
+            self._waited = self._acquired - start
+        return self
+
+    def __exit__(self, *exc):
+        # Read before releasing; the next holder overwrites them
+        acquired, waited = self._acquired, self._waited
+        self.lock.release()
+        self.hold.observe(perf_counter() - acquired)
+        self.wait.observe(waited)
+        return False
+
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in list(_registry):
+        try:
+            lines.extend(metric.render())
+        except Exception as e:
+            lines.append(f"# {metric.name}: {e}")
+    return "\n".join(lines) + "\n"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, host="127.0.0.1"):
+    """Serve /metrics over HTTP from a background thread"""
+    server = HTTPServer((host, port), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
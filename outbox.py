@@ -0,0 +1,97 @@
+import threading
+import time
+
+from protocol import is_binary
+
+# Keep packed datagrams under a typical path MTU
+MAX_DATAGRAM = 1200
+
+
+def pack_messages(messages, max_datagram=MAX_DATAGRAM):
+    """Pack messages into as few datagrams as possible.
+
+    Text messages are newline-separated; binary messages are self-delimiting
+    and simply concatenated. A client only ever receives one of the two.
+    """
+    separator = b"" if is_binary(messages[0]) else b"\n"
+    datagrams = []
+    current = []
+    size = 0
+
+    for message in messages:
+        added = len(message) + (len(separator) if current else 0)
+        if current and size + added > max_datagram:
+            datagrams.append(separator.join(current))
+            current = []
+            added = len(message)
+            size = 0
+        current.append(message)
+        size += added
+
+    if current:
+        datagrams.append(separator.join(current))
+    return datagrams
+
+
+class Outbox:
+    """Coalesces outgoing messages per client over a short tick window.
+
+    Has the same sendto(data, addr) signature as a socket, so the game code
+    can be handed an Outbox instead of a socket. Messages are queued (which
+    is cheap while board_lock is held) and flushed by the scheduler once per
+    tick as one multi-message datagram per client, outside of board_lock.
+    """
+
+    def __init__(self, sock, scheduler, tick=0.01, max_datagram=MAX_DATAGRAM):
+        self.sock = sock
+        self.scheduler = scheduler
+        self.tick = tick
+        self.max_datagram = max_datagram
+
+        self._queues = {}
+        self._lock = threading.Lock()
+        self._flush_timer = None
+
+        # Totals since start, used to report how many datagrams were saved
+        self.messages_sent = 0
+        self.datagrams_sent = 0
+        self._last_report = (time.time(), 0, 0)
+
+    def sendto(self, data, addr):
+        with self._lock:
+            queue = self._queues.get(addr)
+            if queue is None:
+                queue = self._queues[addr] = []
+            queue.append(data)
+
+            # Only arm the flush timer when there is something to send
+            if self._flush_timer is None:
+                self._flush_timer = self.scheduler.call_later(self.tick, self.flush)
+
+    def flush(self):
+        """Send everything queued so far, one or more datagrams per client"""
+        with self._lock:
+            queues = self._queues
+            self._queues = {}
+            self._flush_timer = None
+
+        for addr, messages in queues.items():
+            for datagram in pack_messages(messages, self.max_datagram):
+                try:
+                    self.sock.sendto(datagram, addr)
+                except OSError as e:
+                    print(f"Send error to {addr}: {e}")
+                self.datagrams_sent += 1
+            self.messages_sent += len(messages)
+
+    def saved_per_second(self):
+        """Datagrams per second saved by coalescing since the last call"""
+        now = time.time()
+        last_time, last_messages, last_datagrams = self._last_report
+        self._last_report = (now, self.messages_sent, self.datagrams_sent)
+
+        elapsed = now - last_time
+        if elapsed <= 0:
+            return 0.0
+        saved = (self.messages_sent - last_messages) - (self.datagrams_sent - last_datagrams)
+        return saved / elapsed
@@ -0,0 +1,89 @@
+import random
+import time
+
+
+class PlayerRegistry:
+    """Players indexed by address, name and numeric id.
+
+    Players who leave are dropped from by_addr (the connected set) but kept
+    in by_id and by_name, so cells they claimed still show their name and
+    color. Player records are plain dicts shared by all three indexes, and
+    carry the time the player was last heard from.
+    """
+
+    def __init__(self, colors):
+        self.colors = colors
+        self.by_addr = {}
+        self.by_name = {}
+        self.by_id = {}
+        self.next_id = 1
+        self._colors_in_use = {}
+
+    def __len__(self):
+        return len(self.by_addr)
+
+    def __contains__(self, addr):
+        return addr in self.by_addr
+
+    def get(self, addr):
+        return self.by_addr.get(addr)
+
+    def add(self, addr, binary=False, reliable=False):
+        """Register a new player at addr and assign it a name and a color"""
+        player_id = self.next_id
+        self.next_id += 1
+
+        available_colors = [c for c in self.colors if not self._colors_in_use.get(c)]
+        if not available_colors:
+            color = random.choice(self.colors)
+        else:
+            color = random.choice(available_colors)
+        self._colors_in_use[color] = self._colors_in_use.get(color, 0) + 1
+
+        player = {"id": player_id, "name": f"Player {player_id}", "color": color,
+                  "binary": binary, "reliable": reliable, "addr": addr,
+                  "last_seen": time.time()}
+        self.by_addr[addr] = player
+        self.by_name[player["name"]] = player
+        self.by_id[player_id] = player
+        return player
+
+    def restore(self, player_id, color, addr=None, binary=False):
+        """Re-create a player from a saved game; addr is None for one who had left"""
+        self.next_id = max(self.next_id, player_id + 1)
+        player = {"id": player_id, "name": f"Player {player_id}", "color": color,
+                  "binary": binary, "reliable": False, "addr": addr,
+                  "last_seen": time.time()}
+        self.by_name[player["name"]] = player
+        self.by_id[player_id] = player
+        if addr is not None:
+            self.by_addr[addr] = player
+            self._colors_in_use[color] = self._colors_in_use.get(color, 0) + 1
+        return player
+
+    def remove(self, addr):
+        """Remove a connected player; its id and name stay resolvable"""
+        player = self.by_addr.pop(addr, None)
+        if player is not None:
+            self._colors_in_use[player["color"]] -= 1
+        return player
+
+    def touch(self, addr, now):
+        """Note that a connected player was just heard from"""
+        player = self.by_addr.get(addr)
+        if player is not None:
+            player["last_seen"] = now
+
+    def idle(self, cutoff):
+        """Addresses of connected players not heard from since cutoff"""
+        return [addr for addr, player in list(self.by_addr.items()) if player["last_seen"] < cutoff]
+
+    def info(self, player_id):
+        """Name and color for a player id, including players who have left"""
+        player = self.by_id.get(player_id)
+        if player is None:
+            return f"Player {player_id}", "gray"
+        return player["name"], player["color"]
+
+    def name(self, player_id):
+        return self.info(player_id)[0]
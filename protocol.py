@@ -0,0 +1,335 @@
+import base64
+import struct
+
+# Offered by clients in the text register message: "register,bin1"
+BINARY_TAG = "bin1"
+BINARY_VERSION = 1
+
+# Offered alongside it to get acked, retransmitted delivery: "register,bin1,rel1"
+RELIABLE_TAG = "rel1"
+
+# Every binary opcode has the high bit set, so a datagram whose first byte is
+# >= 0x80 is binary and anything else is the comma-separated text protocol
+OP_TEXT = 0x80
+
+# Prefixes a message with its per-client sequence number: OP_REL, u32 seq,
+# then the message itself. In text the prefix is "rel,<seq>,".
+OP_REL = 0xA0
+
+# Message name -> (opcode, field kinds). Messages without an opcode are sent
+# to binary clients wrapped in OP_TEXT.
+MESSAGES = {
+    "register":            (0x81, ("u8",)),
+    "click":               (0x82, ("u16", "u16")),
+    "end_game":            (0x83, ()),
+    "disconnect":          (0x84, ()),
+    "board_resend":        (0x85, ("u8", "u32", "u32", "u16_list")),
+    "sync":                (0x86, ("u32",)),
+    "get_scores":          (0x87, ()),
+    "ack":                 (0x88, ("u32", "u32_list")),
+    "nack":                (0x89, ("u32", "u32")),
+    "heartbeat":           (0x8A, ()),
+    "grid_config":         (0x90, ("u16", "u16")),
+    "identity":            (0x91, ("player_def", "u32")),
+    "waiting":             (0x92, ("u16", "u16")),
+    "game_start":          (0x93, ()),
+    "player_info":         (0x94, ("player_def",)),
+    "player_joined":       (0x95, ("player_def",)),
+    "player_left":         (0x96, ("player_name",)),
+    "selecting":           (0x97, ("u16", "u16", "player", "ms")),
+    "block_adjacent":      (0x98, ("u16", "u16", "player", "ms")),
+    "unblock_adjacent":    (0x99, ("cells",)),
+    "selection_cancelled": (0x9A, ("u16", "u16")),
+    "update":              (0x9B, ("u16", "u16", "player", "u32")),
+    "game_end":            (0x9C, ("str", "opt_str", "names", "name_scores")),
+    "board_chunk":         (0x9D, ("u8", "u32", "u32", "u16", "u16", "bytes")),
+    "scores":              (0x9E, ("score_list",)),
+    "rejected":            (0x9F, ("str",)),
+    "block_cells":         (0xA1, ("u16", "u16", "player", "ms", "cells")),
+}
+
+# Sent with sequence numbers to clients that registered with RELIABLE_TAG.
+# Selections and blocks are sequenced too, so a held-back unblock or cancel
+# can never land after (and undo) a newer block or selection of the same
+# cells. Board chunks have their own resend and stay unreliable.
+RELIABLE = frozenset(("grid_config", "identity", "waiting", "game_start", "player_info",
+                      "player_joined", "player_left", "selecting", "block_cells", "block_adjacent",
+                      "unblock_adjacent", "selection_cancelled", "update", "game_end"))
+
+# Fixed-width kinds and their struct codes; players travel as their numeric id
+FIXED_KINDS = {"u8": "B", "u16": "H", "u32": "I", "ms": "I", "player": "H", "player_name": "H"}
+
+_U8 = struct.Struct(">B")
+_U16 = struct.Struct(">H")
+_REL = struct.Struct(">BI")
+
+
+def is_binary(data):
+    return len(data) > 0 and data[0] >= OP_TEXT
+
+
+def message_name(data):
+    """Name of the first message in a datagram, without decoding its fields"""
+    if not is_binary(data):
+        return data.split(b",", 1)[0].split(b"\n", 1)[0].decode(errors="replace")
+    if data[0] in (OP_TEXT, OP_REL):
+        return message_name(data[5:])
+    entry = _BY_OPCODE.get(data[0])
+    return entry[0] if entry is not None else None
+
+
+# --- Encoding ---
+
+def _text_field(kind, value):
+    if kind == "ms":
+        return f"{value:.1f}"
+    if kind in ("player", "player_def"):
+        return f"{value['name']},{value['color']}"
+    if kind == "player_name":
+        return value["name"]
+    if kind == "opt_str":
+        return value
+    if kind == "names":
+        return ",".join(value)
+    if kind == "name_scores":
+        return ";".join(f"{name},{score}" for name, score in value)
+    if kind == "score_list":
+        return ",".join(f"{player['name']},{score}" for player, score in value)
+    if kind in ("u16_list", "u32_list"):
+        return ";".join(str(v) for v in value)
+    if kind == "cells":
+        return ",".join(f"{row},{col}" for row, col in value)
+    if kind == "bytes":
+        return base64.b64encode(value).decode()
+    return str(value)
+
+
+def _fixed_value(kind, value):
+    if kind == "ms":
+        return int(round(value * 1000))
+    if kind in ("player", "player_name"):
+        return value["id"]
+    return value
+
+
+def _pack_str(value):
+    raw = value.encode()[:255]
+    return _U8.pack(len(raw)) + raw
+
+
+def _binary_field(kind, value):
+    if kind in FIXED_KINDS:
+        return struct.pack(">" + FIXED_KINDS[kind], _fixed_value(kind, value))
+    if kind == "player_def":
+        return _U16.pack(value["id"]) + _pack_str(value["name"]) + _pack_str(value["color"])
+    if kind == "str":
+        return _pack_str(value)
+    if kind == "opt_str":
+        return _pack_str(value or "")
+    if kind == "names":
+        return _U8.pack(len(value)) + b"".join(_pack_str(name) for name in value)
+    if kind == "name_scores":
+        return _U16.pack(len(value)) + b"".join(_pack_str(name) + struct.pack(">I", score)
+                                                for name, score in value)
+    if kind == "score_list":
+        return _U16.pack(len(value)) + b"".join(struct.pack(">HI", player["id"], score)
+                                                for player, score in value)
+    if kind == "u16_list":
+        return _U16.pack(len(value)) + struct.pack(f">{len(value)}H", *value)
+    if kind == "u32_list":
+        return _U16.pack(len(value)) + struct.pack(f">{len(value)}I", *value)
+    if kind == "bytes":
+        return struct.pack(">I", len(value)) + value
+    if kind == "cells":
+        return _U16.pack(len(value)) + b"".join(_U16.pack(row) + _U16.pack(col) for row, col in value)
+    raise ValueError(f"Unknown field kind {kind}")
+
+
+def _build_fixed_structs():
+    """Precompile one Struct per message whose fields are all fixed width"""
+    structs = {}
+    for name, (opcode, kinds) in MESSAGES.items():
+        if opcode is not None and all(kind in FIXED_KINDS for kind in kinds):
+            structs[name] = struct.Struct(">B" + "".join(FIXED_KINDS[kind] for kind in kinds))
+    return structs
+
+
+_FIXED_STRUCTS = _build_fixed_structs()
+
+
+def encode_text(name, fields):
+    parts = [name]
+    for kind, value in zip(MESSAGES[name][1], fields):
+        if kind == "opt_str" and value is None:
+            continue
+        parts.append(_text_field(kind, value))
+    return ",".join(parts).encode()
+
+
+def encode_binary(name, fields):
+    opcode, kinds = MESSAGES[name]
+    if opcode is None:
+        text = encode_text(name, fields)
+        return bytes([OP_TEXT]) + struct.pack(">I", len(text)) + text
+
+    fixed = _FIXED_STRUCTS.get(name)
+    if fixed is not None:
+        return fixed.pack(opcode, *[_fixed_value(kind, value) for kind, value in zip(kinds, fields)])
+
+    return bytes([opcode]) + b"".join(_binary_field(kind, value) for kind, value in zip(kinds, fields))
+
+
+def encode(name, fields, binary=False):
+    """Encode a message for a client speaking the text or binary protocol"""
+    if binary:
+        return encode_binary(name, fields)
+    return encode_text(name, fields)
+
+
+def frame_reliable(seq, data, binary=False):
+    """Prefix an encoded message with its sequence number"""
+    if binary:
+        return _REL.pack(OP_REL, seq) + data
+    return b"rel,%d," % seq + data
+
+
+# --- Decoding ---
+
+def _read_str(data, offset):
+    length = data[offset]
+    offset += 1
+    return data[offset:offset + length].decode(), offset + length
+
+
+def _lookup(players, player_id):
+    return players.get(player_id, (f"Player {player_id}", "gray"))
+
+
+def _decode_field(kind, data, offset, out, players):
+    if kind in FIXED_KINDS:
+        code = FIXED_KINDS[kind]
+        (value,) = struct.unpack_from(">" + code, data, offset)
+        offset += struct.calcsize(code)
+        if kind == "ms":
+            out.append(value / 1000.0)
+        elif kind == "player":
+            out.extend(_lookup(players, value))
+        elif kind == "player_name":
+            out.append(_lookup(players, value)[0])
+        else:
+            out.append(value)
+    elif kind == "player_def":
+        (player_id,) = _U16.unpack_from(data, offset)
+        name, offset = _read_str(data, offset + 2)
+        color, offset = _read_str(data, offset)
+        players[player_id] = (name, color)
+        out.extend((name, color))
+    elif kind == "str":
+        value, offset = _read_str(data, offset)
+        out.append(value)
+    elif kind == "opt_str":
+        value, offset = _read_str(data, offset)
+        if value:
+            out.append(value)
+    elif kind == "names":
+        count = data[offset]
+        offset += 1
+        names = []
+        for _ in range(count):
+            name, offset = _read_str(data, offset)
+            names.append(name)
+        out.append(";".join(names))
+    elif kind == "name_scores":
+        (count,) = _U16.unpack_from(data, offset)
+        offset += 2
+        pairs = []
+        for _ in range(count):
+            name, offset = _read_str(data, offset)
+            (score,) = struct.unpack_from(">I", data, offset)
+            offset += 4
+            pairs.append(f"{name},{score}")
+        out.append(";".join(pairs))
+    elif kind == "score_list":
+        (count,) = _U16.unpack_from(data, offset)
+        offset += 2
+        for player_id, score in struct.iter_unpack(">HI", data[offset:offset + 6 * count]):
+            out.extend((_lookup(players, player_id)[0], score))
+        offset += 6 * count
+    elif kind == "u16_list":
+        (count,) = _U16.unpack_from(data, offset)
+        values = struct.unpack_from(f">{count}H", data, offset + 2)
+        offset += 2 + 2 * count
+        out.append(";".join(str(v) for v in values))
+    elif kind == "u32_list":
+        (count,) = _U16.unpack_from(data, offset)
+        values = struct.unpack_from(f">{count}I", data, offset + 2)
+        offset += 2 + 4 * count
+        out.append(";".join(str(v) for v in values))
+    elif kind == "cells":
+        (count,) = _U16.unpack_from(data, offset)
+        offset += 2
+        for row, col in struct.iter_unpack(">HH", data[offset:offset + 4 * count]):
+            out.extend((row, col))
+        offset += 4 * count
+    elif kind == "bytes":
+        (length,) = struct.unpack_from(">I", data, offset)
+        offset += 4
+        out.append(bytes(data[offset:offset + length]))
+        offset += length
+    else:
+        raise ValueError(f"Unknown field kind {kind}")
+    return offset
+
+
+_BY_OPCODE = {opcode: (name, kinds) for name, (opcode, kinds) in MESSAGES.items() if opcode is not None}
+
+
+def decode_all(data, players=None):
+    """Decode every message in a binary datagram.
+
+    Messages come back in the same shape as a split text message, e.g.
+    ["update", 3, 4, "Player 2", "blue"], so handlers can treat both
+    protocols alike. A sequenced message comes back as ["rel", seq, ...].
+    players maps player ids to (name, color) and is updated in place by
+    identity/player_info/player_joined messages.
+    """
+    if players is None:
+        players = {}
+
+    messages = []
+    offset = 0
+    seq = None
+    while offset < len(data):
+        opcode = data[offset]
+        offset += 1
+
+        if opcode == OP_REL:
+            (seq,) = struct.unpack_from(">I", data, offset)
+            offset += 4
+            continue
+
+        if opcode == OP_TEXT:
+            (length,) = struct.unpack_from(">I", data, offset)
+            offset += 4
+            out = data[offset:offset + length].decode().split(',')
+            offset += length
+            if seq is not None:
+                out = ["rel", seq] + out
+                seq = None
+            messages.append(out)
+            continue
+
+        name, kinds = _BY_OPCODE[opcode]
+        fixed = _FIXED_STRUCTS.get(name)
+        out = [name]
+        if fixed is not None and not any(kind in ("ms", "player", "player_name") for kind in kinds):
+            out.extend(fixed.unpack_from(data, offset - 1)[1:])
+            offset += fixed.size - 1
+        else:
+            for kind in kinds:
+                offset = _decode_field(kind, data, offset, out, players)
+        if seq is not None:
+            out = ["rel", seq] + out
+            seq = None
+        messages.append(out)
+    return messages
@@ -0,0 +1,42 @@
+import time
+
+
+class RateLimiter:
+    """A token bucket per address.
+
+    Each address may send up to burst messages at once and rate messages per
+    second after that. Buckets that have filled up again are dropped by
+    prune, so quiet addresses cost nothing.
+    """
+
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self._buckets = {}      # addr -> [tokens, time of last refill]
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def allow(self, addr, cost=1.0):
+        """Take cost tokens from addr's bucket; False if it does not have them"""
+        now = self.clock()
+        bucket = self._buckets.get(addr)
+        if bucket is None:
+            self._buckets[addr] = [self.burst - cost, now]
+            return True
+
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if tokens < cost:
+            bucket[0] = tokens
+            return False
+        bucket[0] = tokens - cost
+        return True
+
+    def prune(self):
+        """Forget addresses whose buckets would be full by now"""
+        cutoff = self.clock() - self.burst / self.rate
+        for addr, bucket in list(self._buckets.items()):
+            if bucket[1] <= cutoff:
+                self._buckets.pop(addr, None)
@@ -0,0 +1,166 @@
+import threading
+import time
+from collections import OrderedDict
+
+import protocol
+
+# Retransmit timeout bounds in seconds (RFC 6298 style estimate in between)
+INITIAL_RTO = 0.5
+MIN_RTO = 0.1
+MAX_RTO = 4.0
+
+# A client with a message still unacked after this many retransmits is given
+# up on: its channel is dropped and on_give_up is called, since the client
+# holds everything after the missing message and can never catch up
+MAX_RETRIES = 8
+
+
+class _Channel:
+    """Sequencing and retransmit state for one client"""
+
+    __slots__ = ("next_seq", "unacked", "srtt", "rttvar", "rto", "timer")
+
+    def __init__(self):
+        self.next_seq = 1
+        self.unacked = OrderedDict()    # seq -> [framed data, send time, deadline, retries]
+        self.srtt = None
+        self.rttvar = None
+        self.rto = INITIAL_RTO
+        self.timer = None
+
+    def sample(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = min(MAX_RTO, max(MIN_RTO, self.srtt + 4 * self.rttvar))
+
+
+class ReliableSender:
+    """Adds sequence numbers, acks and retransmits on top of a sender.
+
+    sendto passes messages straight through. send_reliable numbers the
+    message per client and keeps it until the client acks it, either
+    cumulatively (everything up to a sequence number) or selectively (a
+    list of numbers received past a gap). Unacked messages are resent
+    after a timeout derived from the measured round-trip time, and
+    straight away when the client reports a gap with a nack.
+    on_give_up(addr), if set, is called when a client's channel is dropped
+    after MAX_RETRIES.
+    """
+
+    def __init__(self, sock, scheduler, clock=time.time, on_give_up=None):
+        self.sock = sock
+        self.scheduler = scheduler
+        self.clock = clock
+        self.on_give_up = on_give_up
+        self._channels = {}
+        self._lock = threading.Lock()
+
+        self.retransmits = 0
+
+    def sendto(self, data, addr):
+        self.sock.sendto(data, addr)
+
+    def send_reliable(self, data, addr, binary=False):
+        now = self.clock()
+        with self._lock:
+            channel = self._channels.get(addr)
+            if channel is None:
+                channel = self._channels[addr] = _Channel()
+
+            seq = channel.next_seq
+            channel.next_seq += 1
+            framed = protocol.frame_reliable(seq, data, binary)
+            channel.unacked[seq] = [framed, now, now + channel.rto, 0]
+
+            if channel.timer is None:
+                channel.timer = self.scheduler.call_at(now + channel.rto, self._retransmit, addr)
+        self.sock.sendto(framed, addr)
+
+    def ack(self, addr, cumulative, selective=()):
+        """Drop messages up to cumulative and those listed in selective"""
+        now = self.clock()
+        with self._lock:
+            channel = self._channels.get(addr)
+            if channel is None:
+                return
+
+            unacked = channel.unacked
+            while unacked:
+                seq = next(iter(unacked))
+                if seq > cumulative:
+                    break
+                self._acked(channel, unacked.pop(seq), now)
+            for seq in selective:
+                entry = unacked.pop(seq, None)
+                if entry is not None:
+                    self._acked(channel, entry, now)
+
+    def _acked(self, channel, entry, now):
+        # Karn's rule: only messages sent once give a usable RTT sample
+        if entry[3] == 0:
+            channel.sample(now - entry[1])
+
+    def nack(self, addr, first, last):
+        """Resend a range of messages the client reported missing"""
+        with self._lock:
+            channel = self._channels.get(addr)
+            if channel is None:
+                return
+            resend = []
+            for seq in range(first, last + 1):
+                entry = channel.unacked.get(seq)
+                if entry is not None:
+                    entry[3] += 1       # Sent more than once, so no RTT sample (Karn)
+                    resend.append(entry[0])
+            self.retransmits += len(resend)
+        for framed in resend:
+            self.sock.sendto(framed, addr)
+
+    def _retransmit(self, addr):
+        now = self.clock()
+        resend = []
+        with self._lock:
+            channel = self._channels.get(addr)
+            if channel is None:
+                return
+            channel.timer = None
+
+            unacked = channel.unacked
+            gave_up = any(entry[2] <= now and entry[3] >= MAX_RETRIES for entry in unacked.values())
+            if gave_up:
+                del self._channels[addr]
+            else:
+                for entry in unacked.values():
+                    if entry[2] > now:
+                        continue
+                    entry[3] += 1
+                    entry[2] = now + min(MAX_RTO, channel.rto * (2 ** entry[3]))
+                    resend.append(entry[0])
+
+                if unacked:
+                    next_deadline = min(entry[2] for entry in unacked.values())
+                    channel.timer = self.scheduler.call_at(next_deadline, self._retransmit, addr)
+                self.retransmits += len(resend)
+
+        if gave_up:
+            if self.on_give_up is not None:
+                self.on_give_up(addr)
+            return
+        for framed in resend:
+            self.sock.sendto(framed, addr)
+
+    def forget(self, addr):
+        """Drop a client's channel, e.g. when it registers afresh or leaves"""
+        with self._lock:
+            channel = self._channels.pop(addr, None)
+        if channel is not None and channel.timer is not None:
+            self.scheduler.cancel(channel.timer)
+
+    def unacked(self):
+        """Sequenced messages sent to any client and not yet acked"""
+        with self._lock:
+            return sum(len(channel.unacked) for channel in self._channels.values())
@@ -0,0 +1,80 @@
+"""Rebuild games from a server's event log, as they were at any point in time.
+
+    python replay.py events/                      # every open game at the end of the log
+    python replay.py events/ --at 2026-10-17T12:00:05 --room 3
+    python replay.py events/ --list               # every record, to find a time
+
+--at takes local time in ISO format or seconds since the epoch. Games are
+rebuilt from the latest checkpoint before that time, so the log must still
+have a segment that old.
+"""
+import argparse
+import datetime
+import string
+import time
+
+import eventlog
+
+RECORD_NAMES = {eventlog.OPEN: "open", eventlog.JOIN: "join", eventlog.LEAVE: "leave",
+                eventlog.CLAIM: "claim", eventlog.END: "end", eventlog.CLOSE: "close",
+                eventlog.SNAPSHOT: "snapshot", eventlog.CHECKPOINT_END: "checkpoint_end"}
+
+# One character per player id on the printed board
+CELL_CHARS = string.digits[1:] + string.ascii_letters
+
+
+def parse_time(value):
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.datetime.fromisoformat(value).timestamp()
+
+
+def format_time(timestamp):
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(timestamp)) + f".{int(timestamp % 1 * 1000):03d}"
+
+
+def list_records(directory, room=None):
+    for path in eventlog.segments(directory):
+        print(f"-- {path}")
+        for kind, room_id, timestamp, payload in eventlog.read_records(path):
+            if room is None or room_id == room:
+                print(f"{format_time(timestamp)}  room {room_id:<5} {RECORD_NAMES.get(kind, kind):<15} {len(payload)} bytes")
+
+
+def show(room_id, engine):
+    state = "ended" if engine.game_ended else "started" if engine.game_started else "waiting"
+    print(f"Room {room_id}: {engine.rows}x{engine.cols}, {state}, {len(engine.clients)} players connected, "
+          f"board version {engine.snapshots.version}")
+
+    for player_id, score in sorted(engine.player_scores.items(), key=lambda item: item[1], reverse=True):
+        name, color = engine.players.info(player_id)
+        print(f"  {CELL_CHARS[(player_id - 1) % len(CELL_CHARS)]} {name} ({color}): {score}")
+
+    for line in engine.board:
+        print("  " + "".join("." if owner is None else CELL_CHARS[(owner - 1) % len(CELL_CHARS)]
+                             for owner in line))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("log_dir", help="the server's --log-dir")
+    parser.add_argument("--at", type=parse_time, help="rebuild the games as they were at this time")
+    parser.add_argument("--room", type=int, help="only this room")
+    parser.add_argument("--list", action="store_true", help="list the records instead")
+    args = parser.parse_args()
+
+    if args.list:
+        list_records(args.log_dir, args.room)
+        return
+
+    engines = eventlog.replay(args.log_dir, until=args.at)
+    if not engines:
+        print("No games found (the log may not reach back that far)")
+    for room_id, engine in sorted(engines.items()):
+        if args.room is None or room_id == args.room:
+            show(room_id, engine)
+
+
+if __name__ == "__main__":
+    main()
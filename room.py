@@ -0,0 +1,280 @@
+import threading
+import time
+import contextlib
+
+import metrics
+import protocol
+import snapshot
+from engine import GameEngine, SELECTION_DURATION
+from sharding import TileLocks
+
+LOCK_BUCKETS = (1e-6, 5e-6, 1e-5, 5e-5, 1e-4, 5e-4, 1e-3, 5e-3, 1e-2, 5e-2, 0.1)
+
+messages_sent = metrics.Counter("checkbox_messages_sent_total", "Messages sent to clients", "type")
+click_latency = metrics.Histogram(
+    "checkbox_click_to_update_seconds", "Time from an accepted click to its update broadcast",
+    [SELECTION_DURATION + delay for delay in (0, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)])
+lock_wait = metrics.Histogram("checkbox_board_lock_wait_seconds", "Time spent waiting for a board or tile lock",
+                              LOCK_BUCKETS)
+lock_hold = metrics.Histogram("checkbox_board_lock_hold_seconds", "Time a board or tile lock was held",
+                              LOCK_BUCKETS)
+
+# Seconds after a player was sent the whole board before a repeated register
+# sends it again; the earlier snapshot's chunks can still be fetched with
+# board_resend meanwhile
+REJOIN_INTERVAL = 2.0
+
+
+class Room:
+    """One game on the network: a GameEngine plus the socket, scheduler and locks around it.
+
+    Rooms share the server's sender and scheduler; everything else is per
+    room. The engine decides what happens and the room sends the events it
+    returns, keeping one scheduler timer armed for the engine's next
+    deadline. Locks are real threading locks for the threads engine and
+    no-ops (locking=False) when everything runs on one event loop. on_end,
+    if set, is called with the room once its game has ended.
+    """
+
+    def __init__(self, room_id, sock, scheduler, rows, cols, required_players,
+                 shard_size=0, locking=True, clock=time.time, max_players=None):
+        self.room_id = room_id
+        self.sock = sock
+        self.scheduler = scheduler
+        self.rows = rows
+        self.cols = cols
+        self.on_end = None
+        self.log = None                  # EventLog that records this room's game, if any
+
+        make_lock = threading.Lock if locking else contextlib.nullcontext
+        self.locking = locking
+
+        self.board_lock = self.timed(make_lock())
+        # With a sharded board each tile has its own lock instead of board_lock
+        self.tile_locks = TileLocks(rows, cols, shard_size) if locking and shard_size > 0 else None
+
+        # Guards counters, flags and player membership. Always taken after
+        # (never while waiting for) a board or tile lock.
+        self.state_lock = make_lock()
+
+        self.engine = GameEngine(rows, cols, required_players, game_id=room_id, clock=clock,
+                                 state_lock=self.state_lock, max_players=max_players)
+        self.players = self.engine.players
+        self.clients = self.engine.clients
+
+        self.wakeup = None               # (deadline, timer) of the pending tick
+        self.wakeup_lock = make_lock()
+
+        self.click_times = {}            # selection cell -> when the click was accepted
+        self.welcome_times = {}          # player address -> when it was last sent the whole board
+
+    @property
+    def game_started(self):
+        return self.engine.game_started
+
+    @property
+    def game_ended(self):
+        return self.engine.game_ended
+
+    def timed(self, lock):
+        """Record wait and hold times of a real lock"""
+        if not self.locking:
+            return lock
+        return metrics.TimedLock(lock, lock_wait, lock_hold)
+
+    def region_lock(self, row, col):
+        """Lock for work on a cell and its four neighbours"""
+        if self.tile_locks is None:
+            return self.board_lock
+        return self.timed(self.tile_locks.region(row, col))
+
+    def whole_board_lock(self):
+        if self.tile_locks is None:
+            return self.board_lock
+        return self.timed(self.tile_locks.all())
+
+    def send(self, addr, name, *fields):
+        """Send one message to a client in the protocol it registered with"""
+        client = self.clients.get(addr)
+        if client is None:
+            self.sock.sendto(protocol.encode(name, fields), addr)
+            return
+
+        messages_sent.inc(name)
+        binary = client["binary"]
+        data = protocol.encode(name, fields, binary)
+        if client["reliable"] and name in protocol.RELIABLE:
+            self.sock.send_reliable(data, addr, binary)
+        else:
+            self.sock.sendto(data, addr)
+
+    def broadcast(self, name, *fields, exclude=None):
+        """Send a message to every client in the room, encoding it once per protocol"""
+        reliable = name in protocol.RELIABLE
+        encoded = {}
+        sent = 0
+        for client_addr, client_data in list(self.clients.items()):
+            if client_addr == exclude:
+                continue
+            sent += 1
+            binary = client_data["binary"]
+            data = encoded.get(binary)
+            if data is None:
+                data = encoded[binary] = protocol.encode(name, fields, binary)
+            if reliable and client_data["reliable"]:
+                self.sock.send_reliable(data, client_addr, binary)
+            else:
+                self.sock.sendto(data, client_addr)
+        messages_sent.inc(name, sent)
+
+    def dispatch(self, events):
+        """Send the events an engine call returned, then rearm the tick timer.
+
+        Called with the board (or tile) lock the engine call ran under still
+        held, so messages about the same cells go out in the order they
+        happened.
+        """
+        ended = False
+        for event in events:
+            if event.name == "snapshot":
+                with self.state_lock:
+                    key, chunks = self.engine.snapshots.build(self.engine.board, self.players.info)
+                self.send_chunks(event.to, key, chunks, range(len(chunks)))
+            elif event.to is None:
+                self.broadcast(event.name, *event.fields, exclude=event.exclude)
+            else:
+                self.send(event.to, event.name, *event.fields)
+            if event.name == "update":
+                accepted = self.click_times.pop(event.fields[:2], None)
+                if accepted is not None:
+                    click_latency.observe(time.perf_counter() - accepted)
+                if self.log is not None:
+                    row, col, player, version = event.fields
+                    self.log.claim(self.room_id, row, col, player["id"], version)
+            elif event.name == "selection_cancelled":
+                self.click_times.pop(event.fields[:2], None)
+            elif event.name == "game_end":
+                ended = True
+                if self.log is not None:
+                    self.log.end(self.room_id, event.fields[1])
+
+        self.arm()
+        if ended and self.on_end is not None:
+            self.on_end(self)
+
+    def arm(self):
+        """Make sure tick runs by the engine's next deadline"""
+        deadline = self.engine.next_deadline()
+        if deadline is None:
+            return
+        with self.wakeup_lock:
+            if self.wakeup is not None:
+                if self.wakeup[0] <= deadline:
+                    return
+                self.scheduler.cancel(self.wakeup[1])
+            self.wakeup = (deadline, self.scheduler.call_at(deadline, self.tick))
+
+    def tick(self, now=None):
+        """Let the engine process its due deadlines"""
+        with self.wakeup_lock:
+            self.wakeup = None
+        with self.whole_board_lock():
+            self.dispatch(self.engine.tick(now))
+
+    def send_snapshot(self, addr, since=None):
+        """Send the board to a client as chunks, as a delta if since is recent enough"""
+        with self.whole_board_lock(), self.state_lock:
+            key, chunks = self.engine.snapshots.build(self.engine.board, self.players.info, since)
+        self.send_chunks(addr, key, chunks, range(len(chunks)))
+
+    def send_chunks(self, addr, key, chunks, seqs):
+        version, base = key
+        kind = snapshot.FULL if base is None else snapshot.DELTA
+        for seq in seqs:
+            if 0 <= seq < len(chunks):
+                self.send(addr, "board_chunk", kind, version, base or 0, seq, len(chunks), chunks[seq])
+
+    def register(self, addr, binary=False, reliable=False):
+        """Add a player to the room, start the game once it is full and bring them up to date.
+
+        Returns the player, or None if the room has no space left.
+        """
+        with self.whole_board_lock():
+            was_started = self.engine.game_started
+            player, events = self.engine.register(addr, binary, reliable)
+            if self.log is not None and player is not None:
+                self.log.join(self.room_id, player)
+            self.dispatch(events)
+            if player is not None:
+                self.welcome_times[addr] = self.engine.clock()
+
+        if self.engine.game_started and not was_started:
+            print(f"Room {self.room_id}: game starting with {len(self.clients)} players!")
+        return player
+
+    def rejoin(self, addr, binary=False, reliable=False):
+        """Answer a repeated register from a player already in the room, at most every REJOIN_INTERVAL"""
+        now = self.engine.clock()
+        with self.state_lock:
+            if now - self.welcome_times.get(addr, float("-inf")) < REJOIN_INTERVAL:
+                return
+            self.welcome_times[addr] = now
+
+        # Any registration starts its sequence numbers over
+        self.sock.forget(addr)
+        with self.whole_board_lock():
+            self.dispatch(self.engine.rejoin(addr, binary, reliable))
+
+    def click(self, addr, row, col):
+        """Start a selection for a player, if the cell can be selected"""
+        if not (0 <= row < self.rows and 0 <= col < self.cols):
+            return
+
+        with self.region_lock(row, col):
+            events = self.engine.click(addr, row, col)
+            if events:
+                self.click_times[(row, col)] = time.perf_counter()
+                self.dispatch(events)
+
+    def selection_complete(self, row, col, client_addr):
+        """Complete a selection straight away rather than at its deadline"""
+        with self.region_lock(row, col):
+            self.dispatch(self.engine.complete_selection(row, col, client_addr))
+
+    def resend_chunks(self, addr, key, seqs):
+        """Resend some chunks of a snapshot, or a fresh snapshot if it is no longer cached"""
+        chunks = self.engine.snapshots.cached(key)
+        if chunks is None:
+            # Too old to resend piecemeal; start over with a fresh snapshot
+            self.send_snapshot(addr)
+        else:
+            self.send_chunks(addr, key, chunks, seqs)
+
+    def send_scores(self, addr):
+        with self.state_lock:
+            scores = self.engine.score_list()
+        self.send(addr, "scores", scores)
+
+    def request_end(self, addr):
+        """A player asked to end the game early"""
+        with self.whole_board_lock():
+            self.dispatch(self.engine.request_end(addr))
+
+    def disconnect(self, addr):
+        """Remove a player, cancelling their selection in progress"""
+        with self.whole_board_lock():
+            if self.log is not None and addr in self.clients:
+                self.log.leave(self.room_id, addr)
+            self.dispatch(self.engine.disconnect(addr))
+        self.welcome_times.pop(addr, None)
+
+    def close(self):
+        """Cancel the pending tick so a torn-down room can be reclaimed"""
+        with self.wakeup_lock:
+            if self.wakeup is not None:
+                self.scheduler.cancel(self.wakeup[1])
+                self.wakeup = None
+        with self.whole_board_lock():
+            self.engine.close()
+        self.click_times.clear()
+        self.welcome_times.clear()
@@ -0,0 +1,153 @@
+import heapq
+import itertools
+import threading
+import time
+
+
+class Timer:
+    """Handle for a scheduled callback, used to cancel it"""
+
+    __slots__ = ("deadline", "callback", "args", "cancelled", "handle")
+
+    def __init__(self, deadline, callback, args):
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+        self.handle = None
+
+    def cancel(self):
+        self.cancelled = True
+        if self.handle is not None:
+            self.handle.cancel()
+
+
+class TimerScheduler:
+    """Heap-ordered deadline queue served by a single thread.
+
+    The thread sleeps until the earliest deadline (or until a new, earlier
+    timer is scheduled) and runs due callbacks in deadline order. Cancelled
+    timers are dropped lazily when they reach the top of the heap.
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+
+    def call_at(self, deadline, callback, *args):
+        """Run callback(*args) once the clock reaches deadline"""
+        timer = Timer(deadline, callback, args)
+        with self._cond:
+            heapq.heappush(self._heap, (deadline, next(self._counter), timer))
+            # Only wake the thread if this timer is now the earliest one
+            if self._heap[0][2] is timer:
+                self._cond.notify()
+        return timer
+
+    def call_later(self, delay, callback, *args):
+        """Run callback(*args) after delay seconds"""
+        return self.call_at(self.clock() + delay, callback, *args)
+
+    def cancel(self, timer):
+        if timer is not None:
+            timer.cancel()
+
+    def pending(self):
+        """Number of timers still queued (including cancelled ones not yet dropped)"""
+        with self._cond:
+            return len(self._heap)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running:
+                    while self._heap and self._heap[0][2].cancelled:
+                        heapq.heappop(self._heap)
+
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+
+                    delay = self._heap[0][0] - self.clock()
+                    if delay <= 0:
+                        break
+                    self._cond.wait(delay)
+
+                if not self._running:
+                    return
+
+                _, _, timer = heapq.heappop(self._heap)
+
+            # Callbacks run outside the scheduler lock so they can take
+            # board_lock and schedule further timers
+            try:
+                timer.callback(*timer.args)
+            except Exception as e:
+                print(f"Timer error: {e}")
+
+
+class AsyncioScheduler:
+    """TimerScheduler interface backed by an asyncio event loop.
+
+    Deadlines use the same wall clock as TimerScheduler and are converted
+    to loop time, so callers do not need to know which engine is running.
+    Callbacks run on the loop thread.
+    """
+
+    def __init__(self, loop, clock=time.time):
+        self.loop = loop
+        self.clock = clock
+        self._timers = set()
+
+    def start(self):
+        pass
+
+    def stop(self):
+        for timer in self._timers:
+            timer.cancel()
+        self._timers.clear()
+
+    def call_at(self, deadline, callback, *args):
+        """Run callback(*args) once the clock reaches deadline"""
+        timer = Timer(deadline, callback, args)
+        when = self.loop.time() + (deadline - self.clock())
+        timer.handle = self.loop.call_at(when, self._fire, timer)
+        self._timers.add(timer)
+        return timer
+
+    def call_later(self, delay, callback, *args):
+        """Run callback(*args) after delay seconds"""
+        return self.call_at(self.clock() + delay, callback, *args)
+
+    def cancel(self, timer):
+        if timer is not None:
+            timer.cancel()
+            self._timers.discard(timer)
+
+    def pending(self):
+        """Number of timers still queued"""
+        return len(self._timers)
+
+    def _fire(self, timer):
+        self._timers.discard(timer)
+        try:
+            timer.callback(*timer.args)
+        except Exception as e:
+            print(f"Timer error: {e}")
@@ -0,0 +1,74 @@
+import threading
+
+
+class _MultiLock:
+    """Context manager that holds several locks, taken in the given order"""
+
+    __slots__ = ("locks",)
+
+    def __init__(self, locks):
+        self.locks = locks
+
+    def acquire(self, blocking=True):
+        for index, lock in enumerate(self.locks):
+            if not lock.acquire(blocking):
+                # Only reachable without blocking: give back what was taken
+                for taken in reversed(self.locks[:index]):
+                    taken.release()
+                return False
+        return True
+
+    def release(self):
+        for lock in reversed(self.locks):
+            lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+        return False
+
+
+class TileLocks:
+    """One lock per square tile of the grid.
+
+    Work on a cell and its four neighbours locks every tile that region
+    touches (at most three). Locks are always taken in ascending tile
+    order, so two regions that straddle the same tile border cannot
+    deadlock, while clicks in unrelated tiles proceed in parallel.
+    """
+
+    def __init__(self, rows, cols, tile_size=32):
+        self.rows = rows
+        self.cols = cols
+        self.tile_size = tile_size
+        self.tile_cols = (cols + tile_size - 1) // tile_size
+        tile_rows = (rows + tile_size - 1) // tile_size
+        self.locks = [threading.Lock() for _ in range(tile_rows * self.tile_cols)]
+        self._all = _MultiLock(self.locks)
+
+    def tile_of(self, row, col):
+        return (row // self.tile_size) * self.tile_cols + col // self.tile_size
+
+    def region(self, row, col):
+        """Lock for a cell and its orthogonal neighbours"""
+        size = self.tile_size
+        tiles = {self.tile_of(row, col)}
+        if row % size == 0 and row > 0:
+            tiles.add(self.tile_of(row - 1, col))
+        if row % size == size - 1 and row < self.rows - 1:
+            tiles.add(self.tile_of(row + 1, col))
+        if col % size == 0 and col > 0:
+            tiles.add(self.tile_of(row, col - 1))
+        if col % size == size - 1 and col < self.cols - 1:
+            tiles.add(self.tile_of(row, col + 1))
+
+        if len(tiles) == 1:
+            return self.locks[tiles.pop()]
+        return _MultiLock([self.locks[tile] for tile in sorted(tiles)])
+
+    def all(self):
+        """Lock for the whole board, e.g. to take a consistent snapshot"""
+        return self._all
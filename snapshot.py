@@ -0,0 +1,180 @@
+import struct
+from collections import OrderedDict, deque
+
+# Raw bytes per chunk; leaves room for the message header and base64 in text mode
+CHUNK_SIZE = 900
+
+FULL = 0
+DELTA = 1
+
+# Runs longer than this are split so the length fits in a u16
+MAX_RUN = 0xFFFF
+
+_HEADER = struct.Struct(">BIIHH")   # kind, version, base version, rows, cols
+_U16 = struct.Struct(">H")
+_U32 = struct.Struct(">I")
+_RUN = struct.Struct(">HH")         # palette index, run length
+_CHANGE = struct.Struct(">HHH")     # row, col, palette index
+
+
+def _pack_str(value):
+    raw = value.encode()[:255]
+    return bytes([len(raw)]) + raw
+
+
+def _read_str(data, offset):
+    length = data[offset]
+    offset += 1
+    return data[offset:offset + length].decode(), offset + length
+
+
+class _Palette:
+    """Maps owner keys to small indices; index 0 is always the free cell"""
+
+    def __init__(self, lookup):
+        self.lookup = lookup
+        self.index = {None: 0}
+        self.entries = []
+
+    def get(self, owner):
+        idx = self.index.get(owner)
+        if idx is None:
+            idx = self.index[owner] = len(self.entries) + 1
+            self.entries.append(self.lookup(owner))
+        return idx
+
+    def pack(self):
+        parts = [_U16.pack(len(self.entries))]
+        for name, color in self.entries:
+            parts.append(_pack_str(name))
+            parts.append(_pack_str(color))
+        return b"".join(parts)
+
+
+def encode_full(board, rows, cols, version, lookup):
+    """Encode the whole board as a palette plus run-length encoded cells.
+
+    lookup(owner) returns the (name, color) to show for an owner key.
+    """
+    palette = _Palette(lookup)
+    runs = []
+    current = None
+    length = 0
+
+    for row in board:
+        for owner in row:
+            idx = palette.get(owner)
+            if idx == current and length < MAX_RUN:
+                length += 1
+            else:
+                if length:
+                    runs.append(_RUN.pack(current, length))
+                current = idx
+                length = 1
+    if length:
+        runs.append(_RUN.pack(current, length))
+
+    return (_HEADER.pack(FULL, version, 0, rows, cols) + palette.pack() +
+            _U32.pack(len(runs)) + b"".join(runs))
+
+
+def encode_delta(changes, rows, cols, version, base_version, lookup):
+    """Encode the cells claimed after base_version as (row, col, owner) changes"""
+    palette = _Palette(lookup)
+    body = [_CHANGE.pack(row, col, palette.get(owner)) for row, col, owner in changes]
+    return (_HEADER.pack(DELTA, version, base_version, rows, cols) + palette.pack() +
+            _U32.pack(len(body)) + b"".join(body))
+
+
+def decode(data):
+    """Decode a snapshot payload.
+
+    Returns a dict with kind, version, base_version, rows, cols and palette
+    (index -> (name, color), index 0 being None). A FULL snapshot carries
+    "cells", a flat row-major list of palette indices; a DELTA carries
+    "changes", a list of (row, col, palette index).
+    """
+    kind, version, base_version, rows, cols = _HEADER.unpack_from(data, 0)
+    offset = _HEADER.size
+
+    (count,) = _U16.unpack_from(data, offset)
+    offset += 2
+    palette = [None]
+    for _ in range(count):
+        name, offset = _read_str(data, offset)
+        color, offset = _read_str(data, offset)
+        palette.append((name, color))
+
+    (count,) = _U32.unpack_from(data, offset)
+    offset += 4
+
+    snapshot = {"kind": kind, "version": version, "base_version": base_version,
+                "rows": rows, "cols": cols, "palette": palette}
+
+    if kind == FULL:
+        cells = []
+        for idx, length in _RUN.iter_unpack(data[offset:offset + count * _RUN.size]):
+            cells.extend([idx] * length)
+        snapshot["cells"] = cells
+    else:
+        snapshot["changes"] = list(_CHANGE.iter_unpack(data[offset:offset + count * _CHANGE.size]))
+
+    return snapshot
+
+
+def split_chunks(payload, chunk_size=CHUNK_SIZE):
+    return [payload[i:i + chunk_size] for i in range(0, len(payload), chunk_size)] or [b""]
+
+
+class SnapshotStore:
+    """Tracks the board version and serves chunked full or delta snapshots.
+
+    Every claimed cell bumps the version and is remembered in a bounded
+    change history, so a client that knows an older version can be sent
+    just the cells claimed since. Recently built snapshots are cached by
+    version so missing chunks can be resent without re-encoding.
+    """
+
+    def __init__(self, rows, cols, history=4096, cache_size=8, chunk_size=CHUNK_SIZE):
+        self.rows = rows
+        self.cols = cols
+        self.version = 0
+        self.changes = deque(maxlen=history)
+        self.chunk_size = chunk_size
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+
+    def record(self, row, col, owner):
+        """Record a claimed cell and return the new board version"""
+        self.version += 1
+        self.changes.append((self.version, row, col, owner))
+        return self.version
+
+    def _oldest_delta_base(self):
+        if not self.changes:
+            return self.version
+        return self.changes[0][0] - 1
+
+    def build(self, board, lookup, since=None):
+        """Return (cache key, chunks) for a full snapshot or a delta since a version"""
+        if since is not None and self._oldest_delta_base() <= since <= self.version:
+            key = (self.version, since)
+            changes = [(row, col, owner) for version, row, col, owner in self.changes if version > since]
+            payload_fn = lambda: encode_delta(changes, self.rows, self.cols, self.version, since, lookup)
+        else:
+            key = (self.version, None)
+            payload_fn = lambda: encode_full(board, self.rows, self.cols, self.version, lookup)
+
+        chunks = self._cache.get(key)
+        if chunks is None:
+            chunks = split_chunks(payload_fn(), self.chunk_size)
+            self._cache[key] = chunks
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(key)
+        return key, chunks
+
+    def cached(self, key):
+        """Chunks of a recently built snapshot, or None if it has been evicted"""
+        return self._cache.get(key)